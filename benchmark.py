@@ -0,0 +1,291 @@
+""" Load test of the chat server against local stand-ins for every external service.
+
+    python benchmark.py --requests 200 --concurrency 16 --output results.json
+    python benchmark.py --baseline results.json --tolerance 0.25
+
+Firestore, Gemini, LlamaParse and Weaviate are replaced by the fakes in benchmark_fakes.py
+and Ollama by a local NDJSON server, each with a configurable service time. server.py is
+then served on a local port and driven with concurrent /chat, /upload and history requests.
+Throughput and p50/p95/p99 latency of every scenario are printed as JSON. With --baseline,
+the exit status is 1 when a scenario's p95 or throughput got worse than the tolerance allows.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import benchmark_fakes
+
+SCENARIOS = ['chat', 'chat_stream', 'chat_local', 'chat_file', 'chat_files', 'upload', 'history', 'list_chats', 'search']
+WEAVIATE_CONFIGS = {'api_url': 'http://fake-weaviate', 'api_key': 'fake', 'llm_key_header': 'X-Fake', 'llm_key_value': 'fake'}
+
+
+def percentile(values, q):
+    """ Nearest-rank percentile of a sorted list """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def summarize(latencies, errors, elapsed, concurrency):
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        },
+    }
+    result['latency_ms'] = {key: round(value * 1000, 2) if value is not None else None for key, value in result['latency_ms'].items()}
+    return result
+
+
+def run_load(name, task, requests_count, concurrency):
+    """ Run task(worker, i) requests_count times over concurrency workers, timing each call """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(requests_count))
+
+    def worker(worker_id):
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                task(session, worker_id, i)
+            except Exception as e:
+                with lock:
+                    errors[0] += 1
+                print(f"{name} request failed: {e}", file=sys.stderr)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker, worker_id) for worker_id in range(concurrency)]:
+            future.result()
+    return summarize(latencies, errors[0], time.perf_counter() - start, concurrency)
+
+
+class Benchmark:
+    def __init__(self, base_url, workdir, turns, files):
+        self.base_url = base_url
+        self.workdir = workdir
+        self.turns = turns
+        self.files = files
+        self.conversations = {}  # worker id -> conversation id
+        self.attachment = None
+
+    def post_chat(self, session, payload):
+        response = session.post(self.base_url + '/chat', json=payload, timeout=600)
+        response.raise_for_status()
+        return response.json()
+
+    def chat(self, session, worker_id, i):
+        # Every worker keeps one conversation going for `turns` turns, then starts another
+        conversation_id = self.conversations.get(worker_id) if i % self.turns else None
+        result = self.post_chat(session, {'message': f"Question {i} from worker {worker_id}?", 'conversation_id': conversation_id})
+        self.conversations[worker_id] = result['conversation_id']
+
+    def chat_stream(self, session, worker_id, i):
+        payload = {'message': f"Streamed question {i} from worker {worker_id}?", 'stream': True}
+        with session.post(self.base_url + '/chat', json=payload, stream=True, timeout=600) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line.startswith(b'data: ') and json.loads(line[6:]).get('done'):
+                    return
+        raise RuntimeError('Stream ended without a done event')
+
+    def chat_local(self, session, worker_id, i):
+        self.post_chat(session, {'message': f"Local question {i}?", 'use_local_model': 'local'})
+
+    def chat_file(self, session, worker_id, i):
+        path, name = self.attachment
+        self.post_chat(session, {'message': f"What does section {i % 7} say?", 'path': path, 'filename': name})
+
+    def chat_files(self, session, worker_id, i):
+        # A new conversation on files never seen before, so every one of them is uploaded
+        attachments = []
+        for n in range(self.files):
+            path = os.path.join(self.workdir, f"bench-{worker_id}-{i}-{n}.txt")
+            with open(path, 'w') as f:
+                f.write(f"Document {uuid.uuid4()}\n" + "lorem ipsum dolor sit amet\n" * 200)
+            attachments.append({'path': path, 'filename': os.path.basename(path)})
+        self.post_chat(session, {'message': f"Compare these {self.files} documents.", 'attachments': attachments})
+
+    def upload(self, session, worker_id, i):
+        content = f"Document {uuid.uuid4()}\n".encode('utf-8') + b"lorem ipsum dolor sit amet\n" * 200
+        response = session.post(self.base_url + '/upload', files={'file': (f"bench-{worker_id}-{i}.txt", content)}, timeout=600)
+        response.raise_for_status()
+        job_id = response.json()['job_id']
+        # The upload counts as done once Gemini has the file ready
+        while True:
+            status = session.get(self.base_url + f"/upload_status/{job_id}", timeout=60).json()
+            if status.get('status') == 'ready':
+                return
+            if status.get('status') == 'failed':
+                raise RuntimeError(f"Upload job {job_id} failed")
+            time.sleep(0.02)
+
+    def history(self, session, worker_id, i):
+        conversation_ids = list(self.conversations.values())
+        response = session.get(self.base_url + f"/get_chat_content/{conversation_ids[i % len(conversation_ids)]}?limit=50", timeout=60)
+        response.raise_for_status()
+
+    def list_chats(self, session, worker_id, i):
+        session.get(self.base_url + '/list_chats', timeout=60).raise_for_status()
+
+    def make_attachment(self):
+        path = os.path.join(self.workdir, 'bench-attachment.txt')
+        with open(path, 'w') as f:
+            for section in range(7):
+                f.write(f"Section {section}\n" + f"Details of section {section}. " * 300 + "\n\n")
+        self.attachment = (path, os.path.basename(path))
+
+
+def search_task(helper):
+    def task(session, worker_id, i):
+        helper.searchWithText(WEAVIATE_CONFIGS, 'BenchArticle', f"query {i % 50}", 10, 'title', None, None)
+    return task
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def compare(results, baseline, tolerance):
+    """ Scenarios whose p95 grew or throughput shrank by more than tolerance """
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        p95, previous_p95 = result['latency_ms']['p95'], previous['latency_ms']['p95']
+        if p95 is not None and previous_p95 and p95 > previous_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous_p95}ms -> {p95}ms")
+        if previous['throughput_rps'] and result['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {previous['throughput_rps']} -> {result['throughput_rps']} rps")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated, from: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=100, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=5, help='turns per conversation in the chat scenario')
+    parser.add_argument('--files', type=int, default=5, help='attachments per conversation in the chat_files scenario')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--chat-schema', default='embedded', choices=['embedded', 'turns'])
+    parser.add_argument('--response-cache', action='store_true', help='leave the response cache on')
+    for name, value in vars(benchmark_fakes.Latency()).items():
+        parser.add_argument('--fake-' + name.replace('_', '-'), dest=name, type=type(value), default=value,
+                            help=f"{'chunks per answer' if name.endswith('_chunks') else 'service time in seconds'} (default {value})")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Resolved before moving into the scratch directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    for name in vars(benchmark_fakes.latency):
+        setattr(benchmark_fakes.latency, name, getattr(args, name))
+
+    ollama = benchmark_fakes.OllamaServer().start()
+    workdir = tempfile.mkdtemp(prefix='chat-bench-')
+    os.environ.update({
+        'LLM_LOCAL': ollama.url,
+        'LLM_LOCAL_KEEP_ALIVE_INTERVAL': '0',
+        'GEMINI_API_KEY': 'fake',
+        'CHAT_SCHEMA': args.chat_schema,
+        'PARSE_CACHE_DIR': os.path.join(workdir, 'parse_cache'),
+        'RESPONSE_CACHE_SIZE': os.environ.get('RESPONSE_CACHE_SIZE', '1024') if args.response_cache else '0',
+        'TRACE_SAMPLE_RATE': '0',
+        'TRACE_SLOW_SECONDS': '1e9',
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+    })
+    benchmark_fakes.install()
+
+    # /upload saves files relative to the working directory
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)
+    import server
+
+    http_server, base_url = start_server(server.app)
+    benchmark = Benchmark(base_url, workdir, args.turns, args.files)
+    benchmark.make_attachment()
+
+    results = {
+        'config': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'files': args.files,
+            'chat_schema': args.chat_schema,
+            'response_cache': args.response_cache,
+            'latency': vars(benchmark_fakes.latency),
+        },
+        'scenarios': {},
+    }
+    for name in scenarios:
+        if name == 'search':
+            import helper
+            helper.setSearchCache(None)
+            task = search_task(helper)
+        else:
+            task = getattr(benchmark, name)
+        if name == 'history' and not benchmark.conversations:
+            # History needs conversations, create them the way the chat scenario does
+            run_load('chat', benchmark.chat, args.concurrency * args.turns, args.concurrency)
+        results['scenarios'][name] = run_load(name, task, args.requests, args.concurrency)
+
+    http_server.shutdown()
+    ollama.stop()
+
+    report = json.dumps(results, indent=2, default=str)
+    print(report)
+    if output:
+        with open(output, 'w') as f:
+            f.write(report)
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
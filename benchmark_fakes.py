@@ -0,0 +1,614 @@
+""" In-process stand-ins for the services server.py and helper.py talk to, used by benchmark.py.
+
+install() puts fake firebase_admin, google.generativeai, llama_parse / llama_index and
+weaviate modules in sys.modules, so importing server.py afterwards runs against them.
+OllamaServer is a real HTTP server speaking Ollama's NDJSON streaming API. Every fake
+sleeps for a configurable latency so the app's own overhead can be measured on its own
+or under realistic service times.
+"""
+import copy
+import hashlib
+import json
+import sys
+import threading
+import time
+import types
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class Latency:
+    """ Service times of the fakes, in seconds """
+
+    def __init__(self, firestore=0.005, gemini=0.3, gemini_chunk=0.02, gemini_chunks=8,
+                 upload=0.2, file_processing=0.5, ollama=0.2, ollama_chunk=0.01, ollama_chunks=8,
+                 weaviate=0.02):
+        self.firestore = firestore
+        self.gemini = gemini
+        self.gemini_chunk = gemini_chunk
+        self.gemini_chunks = gemini_chunks
+        self.upload = upload
+        self.file_processing = file_processing
+        self.ollama = ollama
+        self.ollama_chunk = ollama_chunk
+        self.ollama_chunks = ollama_chunks
+        self.weaviate = weaviate
+
+
+latency = Latency()
+
+
+def _sleep(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+# -----------------------------------------------
+# Firestore
+# -----------------------------------------------
+DELETE_FIELD = object()
+DOCUMENT_ID = '__name__'
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class FieldPath:
+    @staticmethod
+    def document_id():
+        return DOCUMENT_ID
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, db, path, filters=(), order=None, fields=None, after=None, count=None):
+        self._db = db
+        self._path = path
+        self._filters = list(filters)
+        self._order = order
+        self._fields = fields
+        self._after = after
+        self._count = count
+
+    def _copy(self, **changes):
+        values = dict(filters=self._filters, order=self._order, fields=self._fields, after=self._after, count=self._count)
+        values.update(changes)
+        return Query(self._db, self._path, **values)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction=ASCENDING):
+        return self._copy(order=(field, direction))
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def start_after(self, values):
+        return self._copy(after=values)
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    def get(self):
+        _sleep(latency.firestore)
+        with self._db.lock:
+            documents = list(self._db.collections.get(self._path, {}).items())
+
+        matches = []
+        for doc_id, data in documents:
+            if all(self._matches(data.get(field), op, value) for field, op, value in self._filters):
+                matches.append((doc_id, data))
+
+        if self._order is not None:
+            field, direction = self._order
+            key = self._sort_key(field)
+            matches.sort(key=key, reverse=direction == Query.DESCENDING)
+            if self._after is not None:
+                after = self._after.get(field)
+                reverse = direction == Query.DESCENDING
+                matches = [match for match in matches if (key(match) < after if reverse else key(match) > after)]
+
+        if self._count is not None:
+            matches = matches[:self._count]
+
+        snapshots = []
+        for doc_id, data in matches:
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            snapshots.append(DocumentSnapshot(doc_id, copy.deepcopy(data)))
+        return snapshots
+
+    def stream(self):
+        return iter(self.get())
+
+    @staticmethod
+    def _sort_key(field):
+        if field == DOCUMENT_ID:
+            return lambda match: match[0]
+        return lambda match: match[1].get(field)
+
+    @staticmethod
+    def _matches(actual, op, value):
+        if op == '==':
+            return actual == value
+        if op == '!=':
+            return actual != value
+        if op == 'in':
+            return actual in value
+        raise ValueError(f"Unsupported operator {op}")
+
+
+class CollectionReference(Query):
+    def document(self, doc_id=None):
+        return DocumentReference(self._db, self._path, doc_id or uuid.uuid4().hex)
+
+    def add(self, data):
+        doc_ref = self.document()
+        doc_ref.set(data)
+        return None, doc_ref
+
+
+class DocumentSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class DocumentReference:
+    def __init__(self, db, path, doc_id):
+        self._db = db
+        self._path = path
+        self.id = doc_id
+
+    def collection(self, name):
+        return CollectionReference(self._db, f"{self._path}/{self.id}/{name}")
+
+    def get(self):
+        _sleep(latency.firestore)
+        with self._db.lock:
+            data = self._db.collections.get(self._path, {}).get(self.id)
+            return DocumentSnapshot(self.id, copy.deepcopy(data))
+
+    def set(self, data):
+        _sleep(latency.firestore)
+        self._db.write_set(self, data)
+
+    def update(self, data):
+        _sleep(latency.firestore)
+        self._db.write_update(self, data)
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, doc_ref, data):
+        self._writes.append((self._db.write_set, doc_ref, copy.deepcopy(data)))
+
+    def update(self, doc_ref, data):
+        self._writes.append((self._db.write_update, doc_ref, data))
+
+    def commit(self):
+        if len(self._writes) > 500:
+            raise ValueError('A batch can contain at most 500 writes')
+        _sleep(latency.firestore)
+        with self._db.lock:
+            for write, doc_ref, data in self._writes:
+                write(doc_ref, data)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.collections = {}  # collection path -> {doc id -> data}
+        self.lock = threading.RLock()
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def write_set(self, doc_ref, data):
+        with self.lock:
+            self.collections.setdefault(doc_ref._path, {})[doc_ref.id] = copy.deepcopy(data)
+
+    def write_update(self, doc_ref, data):
+        with self.lock:
+            document = self.collections.get(doc_ref._path, {}).get(doc_ref.id)
+            if document is None:
+                raise KeyError(f"No document to update: {doc_ref._path}/{doc_ref.id}")
+            for field, value in data.items():
+                if value is DELETE_FIELD:
+                    document.pop(field, None)
+                elif isinstance(value, ArrayUnion):
+                    array = document.setdefault(field, [])
+                    array.extend(copy.deepcopy(item) for item in value.values if item not in array)
+                elif isinstance(value, Increment):
+                    document[field] = document.get(field, 0) + value.value
+                else:
+                    document[field] = copy.deepcopy(value)
+
+
+firestore_db = FakeFirestore()
+
+
+def _firebase_modules():
+    firebase_admin = types.ModuleType('firebase_admin')
+    credentials = types.ModuleType('firebase_admin.credentials')
+    firestore = types.ModuleType('firebase_admin.firestore')
+
+    credentials.Certificate = lambda path: {'path': path}
+    firebase_admin.initialize_app = lambda cred=None, options=None, name='[DEFAULT]': types.SimpleNamespace(name=name)
+    firebase_admin.credentials = credentials
+    firebase_admin.firestore = firestore
+
+    firestore.client = lambda app=None: firestore_db
+    firestore.ArrayUnion = ArrayUnion
+    firestore.Increment = Increment
+    firestore.DELETE_FIELD = DELETE_FIELD
+    firestore.FieldPath = FieldPath
+    firestore.Query = Query
+    return {
+        'firebase_admin': firebase_admin,
+        'firebase_admin.credentials': credentials,
+        'firebase_admin.firestore': firestore,
+    }
+
+
+# -----------------------------------------------
+# Gemini
+# -----------------------------------------------
+class FakeFile:
+    def __init__(self, path):
+        self.name = 'files/' + uuid.uuid4().hex[:12]
+        self.display_name = path.replace('\\', '/').split('/')[-1]
+        self.uri = 'https://generativelanguage.googleapis.com/v1beta/' + self.name
+        self.ready_at = time.monotonic() + latency.file_processing
+        self.expiration_time = datetime.now(timezone.utc) + timedelta(hours=48)
+
+    @property
+    def state(self):
+        # 1 is PROCESSING, 2 is ACTIVE
+        return 2 if time.monotonic() >= self.ready_at else 1
+
+
+class FakeCachedContent:
+    def __init__(self, model, ttl):
+        self.name = 'cachedContents/' + uuid.uuid4().hex[:12]
+        self.model = model
+        self.expire_time = datetime.now(timezone.utc) + ttl
+
+    @classmethod
+    def create(cls, model, display_name=None, system_instruction=None, contents=None, ttl=None, **kwargs):
+        _sleep(latency.upload)
+        return cls(model, ttl or timedelta(hours=1))
+
+    def update(self, ttl=None, expire_time=None):
+        self.expire_time = expire_time or datetime.now(timezone.utc) + ttl
+
+    def delete(self):
+        pass
+
+
+def _response(text):
+    part = types.SimpleNamespace(text=text)
+    content = types.SimpleNamespace(parts=[part])
+    return types.SimpleNamespace(candidates=[types.SimpleNamespace(content=content)], text=text)
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name='gemini-1.5-flash-8b', system_instruction=None, **kwargs):
+        self.model_name = model_name if model_name.startswith('models/') else 'models/' + model_name
+        self.system_instruction = system_instruction
+        self.cached_content = None
+
+    @classmethod
+    def from_cached_content(cls, cached_content, **kwargs):
+        model = cls(cached_content.model)
+        model.cached_content = cached_content
+        return model
+
+    def generate_content(self, contents, stream=False, request_options=None, **kwargs):
+        question = contents[-1] if isinstance(contents, list) and contents else contents
+        text = f"Answer from {self.model_name} to: {str(question)[:80]}"
+        if not stream:
+            _sleep(latency.gemini)
+            return _response(text)
+        return self._stream(text)
+
+    def _stream(self, text):
+        _sleep(latency.gemini)
+        size = max(1, len(text) // max(1, latency.gemini_chunks))
+        for start in range(0, len(text), size):
+            if start:
+                _sleep(latency.gemini_chunk)
+            yield _response(text[start:start + size])
+
+    def count_tokens(self, contents):
+        return types.SimpleNamespace(total_tokens=sum(len(str(content)) // 4 for content in contents))
+
+
+gemini_files = {}
+gemini_files_lock = threading.Lock()
+
+
+def _upload_file(path, **kwargs):
+    _sleep(latency.upload)
+    uploaded_file = FakeFile(path)
+    with gemini_files_lock:
+        gemini_files[uploaded_file.name] = uploaded_file
+    return uploaded_file
+
+
+def _get_file(name):
+    _sleep(latency.firestore)
+    with gemini_files_lock:
+        uploaded_file = gemini_files.get(name)
+    if uploaded_file is None:
+        raise KeyError(f"File {name} not found")
+    return uploaded_file
+
+
+def _gemini_modules():
+    genai = types.ModuleType('google.generativeai')
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.upload_file = _upload_file
+    genai.get_file = _get_file
+    genai.caching = types.SimpleNamespace(CachedContent=FakeCachedContent)
+
+    modules = {'google.generativeai': genai}
+    try:
+        import google
+        google.generativeai = genai
+    except ImportError:
+        google = types.ModuleType('google')
+        google.__path__ = []
+        google.generativeai = genai
+        modules['google'] = google
+    return modules
+
+
+# -----------------------------------------------
+# LlamaParse
+# -----------------------------------------------
+def _parse_modules():
+    llama_parse = types.ModuleType('llama_parse')
+    llama_index = types.ModuleType('llama_index')
+    llama_index_core = types.ModuleType('llama_index.core')
+
+    class LlamaParse:
+        def __init__(self, **kwargs):
+            self.settings = kwargs
+
+    class SimpleDirectoryReader:
+        def __init__(self, input_files, file_extractor=None):
+            self.input_files = input_files
+
+        def load_data(self):
+            _sleep(latency.upload)
+            documents = []
+            for path in self.input_files:
+                with open(path, 'rb') as f:
+                    documents.append(types.SimpleNamespace(text=f.read().decode('utf-8', errors='replace')))
+            return documents
+
+    llama_parse.LlamaParse = LlamaParse
+    llama_index_core.SimpleDirectoryReader = SimpleDirectoryReader
+    llama_index.core = llama_index_core
+    return {'llama_parse': llama_parse, 'llama_index': llama_index, 'llama_index.core': llama_index_core}
+
+
+# -----------------------------------------------
+# Weaviate
+# -----------------------------------------------
+class FakeWeaviateCollection:
+    def __init__(self, name, size=1000):
+        self.name = name
+        self.objects = [
+            types.SimpleNamespace(uuid=str(uuid.UUID(int=i)), properties={'title': f"{name} {i}", 'body': f"text {i}"}, vector=None)
+            for i in range(size)
+        ]
+        self.query = types.SimpleNamespace(
+            near_text=self._search,
+            near_object=self._search,
+            fetch_objects=self._search,
+        )
+
+    def _search(self, limit=10, **kwargs):
+        _sleep(latency.weaviate)
+        return types.SimpleNamespace(objects=self.objects[:limit or 10])
+
+    def iterator(self, include_vector=False, **kwargs):
+        return iter(self.objects)
+
+
+class FakeWeaviateClient:
+    def __init__(self):
+        self._collections = {}
+        self.collections = types.SimpleNamespace(get=self._collection)
+
+    def _collection(self, name):
+        return self._collections.setdefault(name, FakeWeaviateCollection(name))
+
+    def is_ready(self):
+        return True
+
+    def close(self):
+        pass
+
+
+def _weaviate_modules():
+    weaviate = types.ModuleType('weaviate')
+    classes = types.ModuleType('weaviate.classes')
+    query = types.ModuleType('weaviate.classes.query')
+
+    class Filter:
+        def __init__(self, field=None):
+            self.field = field
+
+        @classmethod
+        def by_property(cls, field):
+            return cls(field)
+
+        def equal(self, value):
+            return self
+
+        def not_equal(self, value):
+            return self
+
+    def connect_to_weaviate_cloud(cluster_url=None, auth_credentials=None, headers=None, **kwargs):
+        _sleep(latency.weaviate)
+        return FakeWeaviateClient()
+
+    weaviate.connect_to_weaviate_cloud = connect_to_weaviate_cloud
+    weaviate.WeaviateClient = FakeWeaviateClient
+    weaviate.auth = types.SimpleNamespace(AuthApiKey=lambda api_key: api_key)
+    query.Filter = Filter
+    classes.query = query
+    weaviate.classes = classes
+    modules = {'weaviate': weaviate, 'weaviate.classes': classes, 'weaviate.classes.query': query}
+
+    # helper.py is shared with the service that provides these two modules
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        modules['config'] = types.ModuleType('config')
+    try:
+        import app.api.api_entities  # noqa: F401
+    except ImportError:
+        api_entities = types.ModuleType('app.api.api_entities')
+        for message in ('CLASS_FOUND', 'DATA_SAVED_MESSAGE', 'DATA_UPDATED_MESSAGE', 'DATA_DELETED_MESSAGE', 'ALL_DATA_SAVED_MESSAGE'):
+            setattr(api_entities, message, message.lower().replace('_', ' ') + ' {}')
+        app_package = types.ModuleType('app')
+        app_package.__path__ = []
+        api_package = types.ModuleType('app.api')
+        api_package.__path__ = []
+        api_package.api_entities = api_entities
+        app_package.api = api_package
+        modules.update({'app': app_package, 'app.api': api_package, 'app.api.api_entities': api_entities})
+    return modules
+
+
+def install():
+    """ Replace the external service SDKs with the fakes; call before importing server or helper """
+    for modules in (_firebase_modules(), _gemini_modules(), _parse_modules(), _weaviate_modules()):
+        sys.modules.update(modules)
+
+
+# -----------------------------------------------
+# Ollama
+# -----------------------------------------------
+EMBEDDING_SIZE = 64
+
+
+def fake_embedding(text):
+    """ A deterministic unit vector per text """
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(EMBEDDING_SIZE)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/api/version':
+            self._send_json({'version': '0.0.0-fake'})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if self.path == '/api/embed':
+            texts = body.get('input')
+            texts = [texts] if isinstance(texts, str) else texts
+            _sleep(latency.ollama_chunk)
+            self._send_json({'model': body.get('model'), 'embeddings': [fake_embedding(text) for text in texts]})
+        elif self.path == '/api/generate':
+            self._generate(body)
+        else:
+            self.send_error(404)
+
+    def _generate(self, body):
+        timings = {
+            'load_duration': 1_000_000,
+            'prompt_eval_count': len(body.get('prompt') or '') // 4,
+            'prompt_eval_duration': 5_000_000,
+            'eval_count': latency.ollama_chunks,
+            'eval_duration': int(latency.ollama_chunks * latency.ollama_chunk * 1e9),
+            'total_duration': int((latency.ollama + latency.ollama_chunks * latency.ollama_chunk) * 1e9),
+        }
+        if not body.get('prompt'):
+            # An empty prompt only loads the model
+            self._send_json(dict(timings, model=body.get('model'), response='', done=True))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        _sleep(latency.ollama)
+        for i in range(latency.ollama_chunks):
+            if i:
+                _sleep(latency.ollama_chunk)
+            self._send_chunk({'model': body.get('model'), 'response': f"token{i} ", 'done': False})
+        self._send_chunk(dict(timings, model=body.get('model'), response='', done=True))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _send_chunk(self, payload):
+        data = (json.dumps(payload) + '\n').encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class OllamaServer:
+    """ Ollama's /api/generate, /api/embed and /api/version on a local port """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = ThreadingHTTPServer((host, port), _OllamaHandler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-ollama', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,362 @@
+import atexit
+import copy
+import logging
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from lazy import LazyModule
+from telemetry import log_event, span
+
+firestore = LazyModule('firebase_admin.firestore')
+
+log = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+# Record schemas: 'embedded' keeps every turn in the chat document's content array,
+# 'turns' stores each turn as its own document under chat_history/{uuid}/turns
+SCHEMA_EMBEDDED = 'embedded'
+SCHEMA_TURNS = 'turns'
+
+
+def turn_id(created_date, position):
+    """ Turn document ids sort in conversation order """
+    timestamp = int(created_date.timestamp() * 1_000_000)
+    return f"{timestamp:020d}-{position:06d}"
+
+
+def valid_turn_cursor(record, cursor):
+    """ Whether cursor is absent or a cursor load_turns can hand out for the record:
+    a turn document id, or a position in the content array of embedded chats """
+    if not cursor:
+        return True
+    if record.get('schema') == SCHEMA_TURNS:
+        return re.fullmatch(r'\d{20}-\d{6}', cursor) is not None
+    return cursor.isdigit()
+
+
+class ChatHistoryRepository:
+    """ Chat history records in Firestore, with a local cache of hot conversations
+    and write-behind batching.
+
+    Writes update the cache right away and are committed to Firestore by a background
+    thread, so a request never waits on them. Writes that arrive close together are
+    coalesced into one batched commit, and new turns are appended with ArrayUnion
+    instead of rewriting the whole content array. flush() forces pending writes out,
+    and close() does a final flush on shutdown.
+
+    New chats are created with the given schema, existing ones keep the schema stored
+    in their record, so both kinds can be read while migrate_to_turns() runs.
+    """
+
+    def __init__(self, db, collection='chat_history', cache_size=256, flush_interval=0.5, schema=SCHEMA_EMBEDDED):
+        self.db = db
+        self.collection = collection
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.schema = schema
+
+        self._cache = OrderedDict()  # conv_id -> chat record
+        self._turns = {}  # conv_id -> every turn of a 'turns' chat, once loaded
+        self._pending = OrderedDict()  # conv_id -> writes not yet committed
+        self._flushing = OrderedDict()  # conv_id -> writes being committed by flush()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name='chat-history-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def get(self, conv_id):
+        """ Get a chat record by conversation ID, from the cache when possible """
+        with self._lock:
+            record = self._cache.get(conv_id)
+            if record is not None:
+                self._cache.move_to_end(conv_id)
+                return copy.deepcopy(record)
+
+        chats = self.db.collection(self.collection).where('conv_id', '==', conv_id).limit(1).get()
+        if not chats:
+            return None
+
+        record = chats[0].to_dict()
+        record.setdefault('uuid', chats[0].id)
+        with self._lock:
+            # Keep a version cached by a concurrent write, it is newer than what was read
+            record = self._cache.setdefault(conv_id, record)
+            self._cache.move_to_end(conv_id)
+            self._evict()
+            return copy.deepcopy(record)
+
+    def create(self, record):
+        """ Add a new chat record, keyed in Firestore by its uuid """
+        conv_id = record['conv_id']
+        record = dict(record, schema=self.schema)
+        if self.schema == SCHEMA_TURNS:
+            record['turn_count'] = 0
+        with self._lock:
+            if self.schema == SCHEMA_TURNS:
+                self._turns[conv_id] = []
+            self._cache[conv_id] = copy.deepcopy(record)
+            pending = self._pending_for(conv_id, record['uuid'])
+            pending['create'] = copy.deepcopy(record)
+            self._evict()
+        self._wake.set()
+
+    def append_turn(self, conv_id, turns, fields=None):
+        """ Append turns to a chat and update other fields alongside.
+        Returns False when the chat does not exist. """
+        if self.get(conv_id) is None:
+            return False
+
+        fields = copy.deepcopy(fields or {})
+        with self._lock:
+            record = self._cache.get(conv_id)
+            if record is None:
+                return False
+            pending = self._pending_for(conv_id, record['uuid'])
+
+            if record.get('schema') == SCHEMA_TURNS:
+                # The history lives in the turn documents, never rewrite it on the chat itself
+                fields.pop('conversation_context', None)
+                turn_count = record.get('turn_count', 0)
+                for turn in turns:
+                    created_date = turn.get('created_date') or datetime.now(timezone.utc)
+                    pending['turn_docs'].append((turn_id(created_date, turn_count), copy.deepcopy(turn)))
+                    turn_count += 1
+                    if conv_id in self._turns:
+                        self._turns[conv_id].append(copy.deepcopy(turn))
+                pending['turn_increment'] += turn_count - record.get('turn_count', 0)
+                record['turn_count'] = turn_count
+            else:
+                if not isinstance(record.get('content'), list):
+                    record['content'] = []
+                record['content'].extend(copy.deepcopy(turns))
+                pending['turns'].extend(copy.deepcopy(turns))
+
+            record.update(copy.deepcopy(fields))
+            pending['fields'].update(fields)
+        self._wake.set()
+        return True
+
+    def load_turns(self, conv_id, limit=None, cursor=None):
+        """ A page of a chat's turns in conversation order, and the cursor of the page of
+        turns before it (None on the first page). Pages go back from the latest turns, so
+        a chat opens on its end. Returns None when the chat does not exist. """
+        record = self.get(conv_id)
+        if record is None:
+            return None
+
+        if record.get('schema') != SCHEMA_TURNS:
+            content = record.get('content') or []
+            end = int(cursor) if cursor else len(content)
+            start = max(0, end - limit) if limit else 0
+            return content[start:end], (str(start) if start > 0 else None)
+
+        if conv_id in self._pending:
+            # Turns still waiting for the writer would be missing from the query
+            self.flush()
+
+        query = self.db.collection(self.collection).document(record['uuid']).collection('turns') \
+            .order_by(firestore.FieldPath.document_id(), direction='DESCENDING')
+        if cursor:
+            query = query.start_after({firestore.FieldPath.document_id(): cursor})
+        if limit:
+            query = query.limit(limit)
+
+        docs = query.get()
+        turns = [doc.to_dict() for doc in reversed(docs)]
+        next_cursor = docs[-1].id if limit and len(docs) == limit else None
+        return turns, next_cursor
+
+    def get_history(self, conv_id):
+        """ The texts of every turn of a chat, oldest first, as sent to the model """
+        with self._lock:
+            turns = self._turns.get(conv_id)
+        if turns is None:
+            page = self.load_turns(conv_id)
+            if page is None:
+                return []
+            turns = page[0]
+            with self._lock:
+                if conv_id in self._cache and self._cache[conv_id].get('schema') == SCHEMA_TURNS:
+                    self._turns.setdefault(conv_id, copy.deepcopy(turns))
+
+        history = []
+        for turn in turns:
+            text = turn.get('text')
+            history.append(text.get('text') if isinstance(text, dict) else text)
+        return history
+
+    def migrate_to_turns(self):
+        """ Move the content array of every embedded chat into turn documents.
+        Chats already using turn documents are skipped, so it can be re-run. """
+        self.flush()
+        migrated = 0
+        chats = self.db.collection(self.collection).stream()
+        for chat in chats:
+            record = chat.to_dict()
+            if record.get('schema') == SCHEMA_TURNS:
+                continue
+
+            content = record.get('content') if isinstance(record.get('content'), list) else []
+            base_date = record.get('created_date') or datetime(1970, 1, 1, tzinfo=timezone.utc)
+            doc_ref = self.db.collection(self.collection).document(chat.id)
+
+            for start in range(0, len(content), FIRESTORE_BATCH_LIMIT - 1):
+                batch = self.db.batch()
+                for position in range(start, min(start + FIRESTORE_BATCH_LIMIT - 1, len(content))):
+                    turn = content[position]
+                    batch.set(doc_ref.collection('turns').document(turn_id(base_date, position)), turn)
+                batch.commit()
+
+            # Switch the chat over only once all of its turns are written
+            doc_ref.update({
+                'schema': SCHEMA_TURNS,
+                'turn_count': len(content),
+                'content': firestore.DELETE_FIELD,
+                'conversation_context': firestore.DELETE_FIELD,
+            })
+            with self._lock:
+                self._cache.pop(record.get('conv_id'), None)
+                self._turns.pop(record.get('conv_id'), None)
+            migrated += 1
+
+        return migrated
+
+    def pending_records(self, fields):
+        """ The given fields of every chat with writes not committed yet, by conv_id, and
+        whether the chat itself is still to be created in Firestore """
+        records = {}
+        with self._lock:
+            for writes in (self._flushing, self._pending):
+                for conv_id, write in writes.items():
+                    record = self._cache.get(conv_id)
+                    if record is None:
+                        continue
+                    created = conv_id in records and records[conv_id][1]
+                    records[conv_id] = ({field: copy.deepcopy(record.get(field)) for field in fields},
+                                        created or write['create'] is not None)
+        return records
+
+    def update_fields(self, conv_id, fields):
+        """ Update fields of a chat, returns False when the chat does not exist """
+        return self.append_turn(conv_id, [], fields)
+
+    def flush(self):
+        """ Commit every pending write to Firestore in batches """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+                self._flushing = pending
+
+            try:
+                self._commit_all(list(pending.items()))
+            finally:
+                with self._lock:
+                    self._flushing = OrderedDict()
+
+    def _commit_all(self, writes):
+        start = 0
+        while start < len(writes):
+            # Fill each batch up to Firestore's write limit, one chat never spans two batches
+            end = start + 1
+            operations = self._operation_count(writes[start][1])
+            while end < len(writes) and operations + self._operation_count(writes[end][1]) <= FIRESTORE_BATCH_LIMIT:
+                operations += self._operation_count(writes[end][1])
+                end += 1
+
+            try:
+                self._commit(writes[start:end])
+            except Exception:
+                # Put back everything not committed yet so the next flush retries it
+                with self._lock:
+                    for conv_id, write in reversed(writes[start:]):
+                        self._merge_back(conv_id, write)
+                raise
+            start = end
+
+    def close(self):
+        """ Stop the background writer and flush what is left """
+        if self._closed:
+            return
+        self._closed = True
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def _commit(self, writes):
+        batch = self.db.batch()
+        for conv_id, write in writes:
+            doc_ref = self.db.collection(self.collection).document(write['doc_id'])
+            if write['create'] is not None:
+                batch.set(doc_ref, write['create'])
+
+            for doc_id, turn in write['turn_docs']:
+                batch.set(doc_ref.collection('turns').document(doc_id), turn)
+
+            update = dict(write['fields'])
+            if write['turns']:
+                update['content'] = firestore.ArrayUnion(write['turns'])
+            if write['turn_increment']:
+                update['turn_count'] = firestore.Increment(write['turn_increment'])
+            if update:
+                batch.update(doc_ref, update)
+        with span('persist_commit'):
+            batch.commit()
+
+    @staticmethod
+    def _operation_count(write):
+        update = write['fields'] or write['turns'] or write['turn_increment']
+        return (write['create'] is not None) + len(write['turn_docs']) + bool(update)
+
+    def _pending_for(self, conv_id, doc_id):
+        pending = self._pending.get(conv_id)
+        if pending is None:
+            pending = {'doc_id': doc_id, 'create': None, 'turns': [], 'turn_docs': [], 'turn_increment': 0, 'fields': {}}
+            self._pending[conv_id] = pending
+        return pending
+
+    def _merge_back(self, conv_id, write):
+        """ Requeue a failed write ahead of any newer writes for the same chat """
+        newer = self._pending.pop(conv_id, None)
+        if newer is not None:
+            write['create'] = write['create'] or newer['create']
+            write['turns'] = write['turns'] + newer['turns']
+            write['turn_docs'] = write['turn_docs'] + newer['turn_docs']
+            write['turn_increment'] += newer['turn_increment']
+            write['fields'] = dict(write['fields'], **newer['fields'])
+        self._pending[conv_id] = write
+        self._pending.move_to_end(conv_id, last=False)
+
+    def _evict(self):
+        # Chats with uncommitted writes stay cached so reads keep seeing them
+        for conv_id in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if conv_id not in self._pending and conv_id not in self._flushing:
+                del self._cache[conv_id]
+                self._turns.pop(conv_id, None)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                break
+
+            # Give writes arriving close together the chance to share a batch
+            self._stopped.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                log_event(log, 'chat history flush failed', logging.ERROR, error=str(e))
+                self._wake.set()
+                self._stopped.wait(self.flush_interval)
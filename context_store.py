@@ -0,0 +1,117 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from telemetry import log_event
+
+log = logging.getLogger(__name__)
+
+# Rough token estimate, good enough to keep the history inside a budget without
+# calling the model's count_tokens on every turn
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return len(text or '') // CHARS_PER_TOKEN + 1
+
+
+class ConversationContextStore:
+    """ Per-conversation history for the model, isolated between conversations and threads.
+
+    At most max_conversations histories are kept in memory. The least recently used one
+    is dropped when the limit is reached and reloaded with load_context on next use;
+    the history itself is persisted with every turn, so nothing is lost.
+
+    window() returns the part of a history that fits in token_budget. Older turns are
+    dropped or, when a summarizer is given, folded into a running summary. The summary
+    is handed to save_summary so it survives eviction.
+    """
+
+    def __init__(self, load_context, token_budget=8000, max_conversations=512, summarizer=None, save_summary=None):
+        self.load_context = load_context
+        self.token_budget = token_budget
+        self.max_conversations = max_conversations
+        self.summarizer = summarizer
+        self.save_summary = save_summary
+
+        self._contexts = OrderedDict()  # conv_id -> {'history', 'summary', 'summarized'}
+        self._lock = threading.Lock()
+
+    def __contains__(self, conv_id):
+        with self._lock:
+            return conv_id in self._contexts
+
+    def create(self, conv_id, history=None, summary=None, summarized=0):
+        """ Start the context of a conversation without going through load_context,
+        empty for a new conversation or from a history loaded elsewhere """
+        with self._lock:
+            self._contexts[conv_id] = {'history': list(history or []), 'summary': summary, 'summarized': summarized or 0}
+            self._contexts.move_to_end(conv_id)
+            while len(self._contexts) > self.max_conversations:
+                self._contexts.popitem(last=False)
+
+    def get(self, conv_id):
+        """ Every message of the conversation, oldest first """
+        return list(self._context(conv_id)['history'])
+
+    def append(self, conv_id, *messages):
+        context = self._context(conv_id)
+        with self._lock:
+            context['history'].extend(messages)
+
+    def window(self, conv_id, user_message):
+        """ The messages to send with user_message, trimmed to the token budget """
+        context = self._context(conv_id)
+        with self._lock:
+            history = context['history']
+            start = context['summarized']
+            summary = context['summary']
+
+        budget = self.token_budget - estimate_tokens(user_message) - estimate_tokens(summary)
+        used = sum(estimate_tokens(message) for message in history[start:])
+
+        # Drop whole user/model pairs from the front until the rest fits
+        dropped_start = start
+        while used > budget and start < len(history):
+            for message in history[start:start + 2]:
+                used -= estimate_tokens(message)
+            start = min(start + 2, len(history))
+
+        if start > dropped_start and self.summarizer is not None:
+            try:
+                summary = self.summarizer(summary, history[dropped_start:start])
+                with self._lock:
+                    context['summary'] = summary
+                    context['summarized'] = start
+                if self.save_summary is not None:
+                    self.save_summary(conv_id, summary, start)
+            except Exception as e:
+                log_event(log, 'summarizing conversation failed', logging.WARNING, conv_id=conv_id, error=str(e))
+
+        messages = list(history[start:]) + [user_message]
+        if summary:
+            messages.insert(0, f"Summary of the earlier conversation: {summary}")
+        return messages
+
+    def discard(self, conv_id):
+        with self._lock:
+            self._contexts.pop(conv_id, None)
+
+    def _context(self, conv_id):
+        with self._lock:
+            context = self._contexts.get(conv_id)
+            if context is not None:
+                self._contexts.move_to_end(conv_id)
+                return context
+
+        history, summary, summarized = self.load_context(conv_id)
+        with self._lock:
+            context = self._contexts.setdefault(conv_id, {
+                'history': list(history or []),
+                'summary': summary,
+                'summarized': summarized or 0,
+            })
+            self._contexts.move_to_end(conv_id)
+            while len(self._contexts) > self.max_conversations:
+                self._contexts.popitem(last=False)
+            return context
@@ -0,0 +1,180 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+from telemetry import log_event
+
+log = logging.getLogger(__name__)
+
+# google.generativeai File.State values
+STATE_ACTIVE = 2
+STATE_FAILED = 10
+
+
+class FileProcessingFailed(Exception):
+    pass
+
+
+class FileProcessingTimeout(FileProcessingFailed):
+    pass
+
+
+class FileStateWatcher:
+    """ Waits for uploaded Gemini files to become ACTIVE, for every caller at once.
+
+    One scheduler thread keeps the pending files and polls each with get_file when it
+    is due, a few at a time on a small pool. A file is first polled initial_delay
+    seconds after it is watched, then the delay grows by backoff (with some jitter)
+    up to max_delay, so short files resolve quickly and long ones cost few calls.
+
+    watch() returns a Future resolved with the ACTIVE file. It fails with
+    FileProcessingFailed when Gemini reports the FAILED state, and with
+    FileProcessingTimeout once the deadline passes. Every caller watching the same
+    file shares one Future and one polling schedule.
+    """
+
+    def __init__(self, get_file, initial_delay=0.5, max_delay=10.0, backoff=1.6, deadline=600, max_workers=4):
+        self.get_file = get_file
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.deadline = deadline
+        self.max_workers = max_workers
+
+        self._pending = {}  # file name -> entry
+        self._condition = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self.polls = 0
+        self.failures = 0
+        self.timeouts = 0
+
+    def watch(self, uploaded_file, deadline=None):
+        if uploaded_file.state == STATE_ACTIVE:
+            future = Future()
+            future.set_result(uploaded_file)
+            return future
+        if uploaded_file.state == STATE_FAILED:
+            future = Future()
+            future.set_exception(FileProcessingFailed(f"Processing of {uploaded_file.name} failed"))
+            return future
+
+        now = time.monotonic()
+        with self._condition:
+            entry = self._pending.get(uploaded_file.name)
+            if entry is None:
+                entry = self._pending[uploaded_file.name] = {
+                    'future': Future(),
+                    'started': now,
+                    'deadline': now + (deadline or self.deadline),
+                    'delay': self.initial_delay,
+                    'next_poll': now + self.initial_delay,
+                    'polling': False,
+                }
+            else:
+                entry['deadline'] = max(entry['deadline'], now + (deadline or self.deadline))
+            self._start()
+            self._condition.notify()
+        return entry['future']
+
+    def wait(self, uploaded_file, deadline=None):
+        """ Block until the file is ACTIVE and return it. Gives up with
+        FileProcessingTimeout once the deadline has passed, even if the scheduler died. """
+        future = self.watch(uploaded_file, deadline)
+        try:
+            # The last poll lands on the deadline, allow it one poll interval to come back
+            return future.result(timeout=(deadline or self.deadline) + self.max_delay)
+        except TimeoutError:
+            raise FileProcessingTimeout(f"{uploaded_file.name} was not ready in time") from None
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending),
+                'polls': self.polls,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+            }
+
+    def _start(self):
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='file-state-poll')
+            self._thread = threading.Thread(target=self._run, name='file-state-watcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = [name for name, entry in self._pending.items() if not entry['polling'] and entry['next_poll'] <= now]
+                if not due:
+                    waiting = [entry['next_poll'] for entry in self._pending.values() if not entry['polling']]
+                    self._condition.wait(min(waiting) - now if waiting else None)
+                    continue
+                for name in due:
+                    self._pending[name]['polling'] = True
+            try:
+                for name in due:
+                    self._executor.submit(self._poll, name)
+            except RuntimeError as e:
+                # The pool refuses work at interpreter exit; fail every waiter rather than leave them blocked
+                self._fail_pending(e)
+                return
+
+    def _fail_pending(self, error):
+        with self._condition:
+            pending = list(self._pending.items())
+            self._pending.clear()
+            self._thread = None
+        log_event(log, 'file state watcher stopped', logging.WARNING, pending=len(pending), error=str(error))
+        for name, entry in pending:
+            if not entry['future'].done():
+                entry['future'].set_exception(FileProcessingFailed(f"Stopped watching {name}: {error}"))
+
+    def _poll(self, name):
+        error = None
+        uploaded_file = None
+        try:
+            uploaded_file = self.get_file(name)
+        except Exception as e:
+            # A failed poll is retried on the usual schedule until the deadline
+            error = e
+
+        outcome = None
+        with self._condition:
+            self.polls += 1
+            entry = self._pending.get(name)
+            if entry is None:
+                # Failed by _fail_pending while this poll was running
+                return
+            now = time.monotonic()
+            if uploaded_file is not None and uploaded_file.state == STATE_ACTIVE:
+                log_event(log, 'file active', logging.DEBUG, storage_name=name, seconds=round(now - entry['started'], 3))
+                outcome = uploaded_file
+            elif uploaded_file is not None and uploaded_file.state == STATE_FAILED:
+                self.failures += 1
+                log_event(log, 'file processing failed', logging.WARNING, storage_name=name)
+                outcome = FileProcessingFailed(f"Processing of {name} failed")
+            elif now >= entry['deadline']:
+                self.timeouts += 1
+                log_event(log, 'file processing timed out', logging.WARNING, storage_name=name,
+                          seconds=round(now - entry['started'], 3), error=str(error) if error else None)
+                outcome = FileProcessingTimeout(f"{name} was not ready in time")
+            else:
+                if error is not None:
+                    log_event(log, 'file state poll failed', logging.WARNING, storage_name=name, error=str(error))
+                entry['delay'] = min(entry['delay'] * self.backoff, self.max_delay)
+                # The last poll lands on the deadline rather than past it
+                entry['next_poll'] = min(now + entry['delay'] * random.uniform(0.9, 1.1), entry['deadline'])
+                entry['polling'] = False
+            if outcome is not None:
+                del self._pending[name]
+            self._condition.notify()
+
+        # Waiters run their callbacks outside the lock
+        if isinstance(outcome, Exception):
+            entry['future'].set_exception(outcome)
+        elif outcome is not None:
+            entry['future'].set_result(outcome)
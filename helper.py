@@ -1,6 +1,19 @@
 # -----------------------------------------------
 # Importing required dependencies
 # -----------------------------------------------
+import atexit
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+import numpy as np
 import weaviate
 from weaviate.classes.query import Filter
 import config as cfg
@@ -8,6 +21,326 @@ import config as cfg
 # Importing api_entities
 import app.api.api_entities as api_entities
 
+# -----------------------------------------------
+# Weaviate Connection Pool
+# -----------------------------------------------
+def connectWeaviate(weaviate_configs):
+    """
+    Open a new connection to the Weaviate cloud instance described by the configs.
+
+    Args:
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+
+    Returns:
+        weaviate.WeaviateClient: A connected client.
+    """
+    return weaviate.connect_to_weaviate_cloud(
+        cluster_url=weaviate_configs["api_url"],
+        auth_credentials=weaviate.auth.AuthApiKey(weaviate_configs["api_key"].replace('Bearer ', '')),
+        headers={weaviate_configs["llm_key_header"]: weaviate_configs["llm_key_value"]}
+    )
+
+class WeaviateConnectionPool:
+    """
+    Process-wide pool of Weaviate clients, keyed by the connection configs.
+
+    Opening a client means a full connect/TLS handshake, which costs more than most
+    queries. The pool keeps idle clients per config and hands each one to a single
+    caller at a time.
+
+    Attributes:
+        max_idle_per_key (int): The maximum number of idle clients kept for one config.
+        idle_timeout (float): Seconds after which an unused client is closed.
+        health_check_interval (float): Seconds after which a client is checked with `is_ready()` before reuse.
+
+    Usage:
+        client = weaviate_pool.checkout(weaviate_configs)
+        try:
+            # Perform operations with the client
+        finally:
+            weaviate_pool.checkin(weaviate_configs, client)
+    """
+
+    def __init__(self, max_idle_per_key=4, idle_timeout=300, health_check_interval=30):
+        self.max_idle_per_key = max_idle_per_key
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._idle = {}  # pool key -> list of [client, last_used, last_checked]
+
+    @staticmethod
+    def poolKey(weaviate_configs):
+        return (weaviate_configs["api_url"], weaviate_configs["api_key"],
+                weaviate_configs["llm_key_header"], weaviate_configs["llm_key_value"])
+
+    def checkout(self, weaviate_configs):
+        """
+        Take an idle healthy client for the configs, or open a new one.
+
+        Args:
+            weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+
+        Returns:
+            weaviate.WeaviateClient: A client owned by the caller until it is checked in.
+        """
+        key = self.poolKey(weaviate_configs)
+        self.evictIdle()
+
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    break
+                client, last_used, last_checked = idle.pop()
+
+            if time.monotonic() - last_checked < self.health_check_interval or self._isHealthy(client):
+                return client
+            self._close(client)
+
+        return connectWeaviate(weaviate_configs)
+
+    def checkin(self, weaviate_configs, client, healthy=True):
+        """
+        Return a client to the pool.
+
+        Args:
+            weaviate_configs (dict): Configuration dictionary the client was checked out with.
+            client (weaviate.WeaviateClient): The client to return.
+            healthy (bool, optional): False forces a health check before the client is reused. Defaults to True.
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault(self.poolKey(weaviate_configs), [])
+            if len(idle) < self.max_idle_per_key:
+                idle.append([client, now, now if healthy else 0])
+                client = None
+
+        if client is not None:
+            self._close(client)
+
+    def evictIdle(self):
+        """ Close every client that has not been used within the idle timeout. """
+        expired = []
+        now = time.monotonic()
+        with self._lock:
+            for key, idle in self._idle.items():
+                expired.extend(entry[0] for entry in idle if now - entry[1] > self.idle_timeout)
+                idle[:] = [entry for entry in idle if now - entry[1] <= self.idle_timeout]
+
+        for client in expired:
+            self._close(client)
+
+    def closeAll(self):
+        """ Close every idle client, e.g. on shutdown. """
+        with self._lock:
+            clients = [entry[0] for idle in self._idle.values() for entry in idle]
+            self._idle.clear()
+
+        for client in clients:
+            self._close(client)
+
+    @staticmethod
+    def _isHealthy(client):
+        try:
+            return client.is_ready()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+weaviate_pool = WeaviateConnectionPool()
+atexit.register(weaviate_pool.closeAll)
+
+# Shared workers for fanning out batch searches over one client
+SEARCH_BATCH_WORKERS = 16
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_BATCH_WORKERS, thread_name_prefix='weaviate-search')
+
+# -----------------------------------------------
+# Search Result Cache
+# -----------------------------------------------
+class SearchResultCache:
+    """
+    TTL cache for semantic search results, bounded by the size of the cached results.
+
+    Results live in an in-memory LRU with a byte budget and, when `disk_dir` is set, in a
+    local on-disk tier that survives restarts. Entries are stored pickled, so callers always
+    get their own copy. Writes to a collection should call `invalidate` to drop its entries.
+    Each invalidation bumps the collection's generation; a search passes the generation it
+    started under to `put`, so a result read before a write is not stored after it.
+
+    Attributes:
+        ttl (float): Seconds a cached result stays valid.
+        max_bytes (int): Budget for the pickled results held in memory.
+        disk_dir (str): Directory of the on-disk tier, or None to keep results in memory only.
+        hits, disk_hits, misses, evictions (int): Counters for monitoring, see `stats()`.
+
+    Usage:
+        search_cache = SearchResultCache(ttl=300, max_bytes=64 * 1024 * 1024, disk_dir="search_cache")
+        setSearchCache(search_cache)
+    """
+
+    def __init__(self, ttl=300, max_bytes=64 * 1024 * 1024, disk_dir=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, pickled result)
+        self._generations = {}  # (api_url, class_name) -> number of invalidations
+        self._bytes = 0
+
+    @staticmethod
+    def makeKey(weaviate_configs, class_name, search_question, limit, return_fields, filter_property, auto_limit):
+        """ Normalize the search arguments so equivalent calls share one entry. """
+        question = ' '.join(str(search_question).lower().split())
+        fields = ','.join(sorted(field.strip() for field in return_fields.split(','))) if return_fields else ''
+        return (weaviate_configs["api_url"], class_name, question, limit, fields, filter_property or '', auto_limit)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return pickle.loads(entry[1])
+                self._remove(key)
+
+        entry = self._readDisk(key)
+        if entry is not None and entry[0] > now:
+            with self._lock:
+                self.disk_hits += 1
+                self._store(key, entry)
+            return pickle.loads(entry[1])
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def generation(self, key):
+        """ The generation of the key's collection, to take before searching and pass to `put`. """
+        with self._lock:
+            return self._generations.get(key[:2], 0)
+
+    def put(self, key, result, generation=None):
+        entry = (time.time() + self.ttl, pickle.dumps(result))
+        with self._lock:
+            if generation is not None and self._generations.get(key[:2], 0) != generation:
+                return
+            self._store(key, entry)
+        self._writeDisk(key, entry)
+
+        # An invalidation that ran while the file was written may have missed it
+        if generation is not None and self.generation(key) != generation:
+            self._removeDisk(key)
+
+    def invalidate(self, weaviate_configs, class_name):
+        """ Drop every cached result of a collection, e.g. after it was written to. """
+        collection_key = (weaviate_configs["api_url"], class_name)
+        with self._lock:
+            self._generations[collection_key] = self._generations.get(collection_key, 0) + 1
+            for key in [key for key in self._entries if key[:2] == collection_key]:
+                self._remove(key)
+
+        if self.disk_dir:
+            shutil.rmtree(self._diskPath(collection_key), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def _store(self, key, entry):
+        if len(entry[1]) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += len(entry[1])
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry[1])
+
+    def _diskPath(self, collection_key, key=None):
+        path = os.path.join(self.disk_dir, hashlib.sha256(repr(collection_key).encode('utf-8')).hexdigest())
+        if key is not None:
+            path = os.path.join(path, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + '.pkl')
+        return path
+
+    def _readDisk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._diskPath(key[:2], key), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def _writeDisk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._diskPath(key[:2], key)
+        temp_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A temp file of its own, so concurrent writers of the same key do not mix
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f)
+            os.replace(temp_path, path)
+        except OSError:
+            if temp_path is not None:
+                try:
+                    os.unlink(temp_path)
+                except OSError:
+                    pass
+
+    def _removeDisk(self, key):
+        if not self.disk_dir:
+            return
+        try:
+            os.unlink(self._diskPath(key[:2], key))
+        except OSError:
+            pass
+
+search_cache = SearchResultCache(
+    ttl=getattr(cfg, 'SEARCH_CACHE_TTL', 300),
+    max_bytes=getattr(cfg, 'SEARCH_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+    disk_dir=getattr(cfg, 'SEARCH_CACHE_DIR', None),
+)
+
+def setSearchCache(cache):
+    """ Replace the search result cache, or pass None to disable caching. """
+    global search_cache
+    search_cache = cache
+
+def getSearchCacheStats():
+    """ Hit/miss counters of the search result cache, for monitoring. """
+    return search_cache.stats() if search_cache is not None else {}
+
+def _invalidateSearchCache(weaviate_configs, class_name):
+    if search_cache is not None:
+        search_cache.invalidate(weaviate_configs, class_name)
+
 # -----------------------------------------------
 # Weaviate Connection Manager 
 # -----------------------------------------------
@@ -15,14 +348,13 @@ class WeaviateConnectionManager:
     """
     Context manager for handling the connection to Weaviate.
 
-    This class establishes a connection to the Weaviate instance using the provided 
-    configuration parameters and ensures that the connection is properly closed after use.
+    This class checks out a client from the process-wide `weaviate_pool` for the provided
+    configuration parameters and returns it to the pool after use, so repeated calls reuse
+    the same connection instead of reconnecting every time.
 
     Attributes:
-        cluster_url (str): The URL of the Weaviate instance.
-        api_key (str): The API key for authenticating with Weaviate.
-        llm_key_header (str): The LLM key name for integration e.g. 'X-OpenAI-Api-Key' or 'X-Palm-Api-Key'
-        llm_key_value (str): The LLM key value (hash code) for integration.
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+        pooled (bool): Use the shared pool. When False a dedicated connection is opened and closed.
         client (weaviate.Client): The Weaviate client object.
 
     Usage:
@@ -37,38 +369,45 @@ class WeaviateConnectionManager:
             # Perform operations with the client
     """
     
-    def __init__(self, weaviate_configs):
-        self.cluster_url = weaviate_configs["api_url"]
-        self.api_key = weaviate_configs["api_key"].replace('Bearer ', '')
-        self.llm_key_header = weaviate_configs["llm_key_header"]
-        self.llm_key_value = weaviate_configs["llm_key_value"]
+    def __init__(self, weaviate_configs, pooled=True):
+        self.weaviate_configs = weaviate_configs
+        self.pooled = pooled
         self.client = None
 
     def __enter__(self):
-        self.client = weaviate.connect_to_weaviate_cloud(
-            cluster_url=self.cluster_url,
-            auth_credentials=weaviate.auth.AuthApiKey(self.api_key),
-            headers={self.llm_key_header: self.llm_key_value}
-        )
+        if self.pooled:
+            self.client = weaviate_pool.checkout(self.weaviate_configs)
+        else:
+            self.client = connectWeaviate(self.weaviate_configs)
         
         return self.client
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.client:
-            self.client.close()
+            if self.pooled:
+                # After a failure the connection may be broken, so re-check it before reuse
+                weaviate_pool.checkin(self.weaviate_configs, self.client, healthy=exc_type is None)
+            else:
+                self.client.close()
+            self.client = None
 
 # ------------------------------------------------------------------------------------
 # Weaviate methods
-# - We will be using context manager as it will close the connection itself
+# - We will be using context manager as it will return the pooled connection itself
 # ------------------------------------------------------------------------------------
 # Get All objects from Class or Collection
-def getObjectsOfCollection(weaviate_configs, class_name):
+def getObjectsOfCollection(weaviate_configs, class_name, include_vector=False):
     """
     Retrieve all objects from a specified class or collection in Weaviate.
 
+    This materializes the whole collection in memory; use `iterateObjectsOfCollection`
+    for large collections.
+
     Args:
         weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
         class_name (str): The name of the class or collection.
+        include_vector (bool, optional): Fetch the object vectors as well. Defaults to False,
+            in which case `vector` is empty.
 
     Returns:
         tuple: A message indicating the status and a list of objects in the specified class.
@@ -85,7 +424,7 @@ def getObjectsOfCollection(weaviate_configs, class_name):
             collection = client.collections.get(class_name)
             
             objects_in_collection = [{'item': object.properties, 
-                                    'vector': object.vector} for object in collection.iterator(include_vector=False )]
+                                    'vector': object.vector} for object in collection.iterator(include_vector=include_vector)]
             
             message = api_entities.CLASS_FOUND.format(class_name)
             
@@ -93,6 +432,142 @@ def getObjectsOfCollection(weaviate_configs, class_name):
 
     except Exception as ex:
         raise
+
+# Stream objects of Class or Collection page by page
+def iterateObjectsOfCollection(weaviate_configs, class_name, page_size=500, return_fields=None, include_vector=False, vector_name="default"):
+    """
+    Iterate over all objects of a class or collection one page at a time.
+
+    Only one page is held in memory, so full-collection dumps run in constant memory and
+    the first page is available as soon as Weaviate returns it.
+
+    Args:
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+        class_name (str): The name of the class or collection.
+        page_size (int, optional): Number of objects fetched and yielded per page. Defaults to 500.
+        return_fields (str, optional): A comma-separated string of properties to fetch. Defaults to all properties.
+        include_vector (bool, optional): Fetch the object vectors. Defaults to False.
+        vector_name (str, optional): The named vector to return. Defaults to "default".
+
+    Yields:
+        dict: A page with
+            - uuids (list): The object UUIDs as strings.
+            - items (list): The object properties.
+            - vectors (numpy.ndarray | None): A (len(items), dim) float32 array when `include_vector` is set.
+
+    Example:
+        for page in iterateObjectsOfCollection(weaviate_configs, "MyClass", return_fields="brief_id,brief_name"):
+            process(page["items"])
+    """
+
+    return_properties = [field.strip() for field in return_fields.split(',')] if return_fields else None
+
+    with WeaviateConnectionManager(weaviate_configs) as client:
+        collection = client.collections.get(class_name)
+        objects = collection.iterator(
+            include_vector=include_vector,
+            return_properties=return_properties,
+            cache_size=page_size,
+        )
+
+        page = []
+        for object in objects:
+            page.append(object)
+            if len(page) == page_size:
+                yield _collectionPage(page, include_vector, vector_name)
+                page = []
+        if page:
+            yield _collectionPage(page, include_vector, vector_name)
+
+def _collectionPage(objects, include_vector, vector_name):
+    vectors = None
+    if include_vector:
+        vectors = np.asarray([object.vector[vector_name] for object in objects], dtype=np.float32)
+
+    return {
+        'uuids': [str(object.uuid) for object in objects],
+        'items': [object.properties for object in objects],
+        'vectors': vectors,
+    }
+
+# Export Class or Collection as NDJSON
+def exportCollectionNDJSON(weaviate_configs, class_name, output, page_size=500, return_fields=None, include_vector=False):
+    """
+    Write every object of a class or collection to a file object as newline-delimited JSON.
+
+    Args:
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+        class_name (str): The name of the class or collection.
+        output (file): A text file object to write to.
+        page_size (int, optional): Number of objects fetched per page. Defaults to 500.
+        return_fields (str, optional): A comma-separated string of properties to export. Defaults to all properties.
+        include_vector (bool, optional): Export the object vectors as well. Defaults to False.
+
+    Returns:
+        int: The number of exported objects.
+
+    Example:
+        with open("MyClass.ndjson", "w") as f:
+            count = exportCollectionNDJSON(weaviate_configs, "MyClass", f)
+    """
+
+    count = 0
+    for page in iterateObjectsOfCollection(weaviate_configs, class_name, page_size, return_fields, include_vector):
+        for index, item in enumerate(page['items']):
+            row = {'uuid': page['uuids'][index], 'item': item}
+            if page['vectors'] is not None:
+                row['vector'] = page['vectors'][index].tolist()
+            output.write(json.dumps(row, default=str) + '\n')
+        count += len(page['items'])
+
+    return count
+
+# Export Class or Collection as an Arrow IPC stream
+def exportCollectionArrow(weaviate_configs, class_name, path, page_size=500, return_fields=None, include_vector=False):
+    """
+    Write every object of a class or collection to an Arrow IPC stream file, one record batch per page.
+
+    Requires the optional `pyarrow` package.
+
+    Args:
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+        class_name (str): The name of the class or collection.
+        path (str): The file path to write to.
+        page_size (int, optional): Number of objects fetched per page. Defaults to 500.
+        return_fields (str, optional): A comma-separated string of properties to export. Defaults to all properties.
+        include_vector (bool, optional): Export the object vectors as a `vector` list column. Defaults to False.
+
+    Returns:
+        int: The number of exported objects.
+
+    Example:
+        count = exportCollectionArrow(weaviate_configs, "MyClass", "MyClass.arrow", include_vector=True)
+    """
+
+    import pyarrow as pa
+
+    count = 0
+    writer = None
+    try:
+        for page in iterateObjectsOfCollection(weaviate_configs, class_name, page_size, return_fields, include_vector):
+            rows = [dict(item, uuid=page['uuids'][index]) for index, item in enumerate(page['items'])]
+            if page['vectors'] is not None:
+                for index, row in enumerate(rows):
+                    row['vector'] = page['vectors'][index].tolist()
+
+            if writer is None:
+                table = pa.Table.from_pylist(rows)
+                writer = pa.ipc.new_stream(path, table.schema)
+            else:
+                table = pa.Table.from_pylist(rows, schema=writer.schema)
+            writer.write_table(table)
+            count += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return count
+
 # Create data object in Class or Collection
 def createObject(weaviate_configs, class_name, object_data):
     """
@@ -116,6 +591,7 @@ def createObject(weaviate_configs, class_name, object_data):
          
             collection = client.collections.get(class_name)
             uuid = collection.data.insert( properties=object_data )
+            _invalidateSearchCache(weaviate_configs, class_name)
             
             message = api_entities.DATA_SAVED_MESSAGE.format(class_name)
             
@@ -152,6 +628,7 @@ def updateObject(weaviate_configs, class_name, object_uuid, object_data):
                     uuid=object_uuid,
                     properties=object_data,
                 )
+            _invalidateSearchCache(weaviate_configs, class_name)
             
             message = api_entities.DATA_UPDATED_MESSAGE.format(class_name)
             
@@ -185,6 +662,7 @@ def deleteObject(weaviate_configs, class_name, object_uuid):
             collection.data.delete_by_id(
                     object_uuid
                 )
+            _invalidateSearchCache(weaviate_configs, class_name)
             
             message = api_entities.DATA_DELETED_MESSAGE.format(class_name)
             
@@ -260,6 +738,7 @@ def createBatchObjects (weaviate_configs, class_name, data_rows):
                     batch.add_object(
                         properties=data_row,
                     )
+            _invalidateSearchCache(weaviate_configs, class_name)
             
             message = api_entities.ALL_DATA_SAVED_MESSAGE.format(class_name)
             
@@ -339,19 +818,24 @@ def searchWithText(weaviate_configs, class_name, search_question, limit, return_
         # Returns a list of dictionaries with the specified fields for each matched object.
     """
         
+    cache_key = None
+    if search_cache is not None:
+        cache_key = search_cache.makeKey(weaviate_configs, class_name, search_question, limit, return_fields, filter_property, auto_limit)
+        cache_generation = search_cache.generation(cache_key)
+        cached_result = search_cache.get(cache_key)
+        if cached_result is not None:
+            return cached_result
+
     try:
         # Using Content manager to initiate the client as it will close the connection automatically
         with WeaviateConnectionManager(weaviate_configs) as client:
             
             collection = client.collections.get(class_name)
-            filters = Filter.by_property(filter_property).not_equal("OBJ_TEMP") if filter_property else None #filter temporary objects from search results
-            response = collection.query.near_text(
-                query=search_question,
-                limit=limit,
-                auto_limit=auto_limit,
-                filters=filters
-            )
-            return getResponseData(response.objects, return_fields)
+            result = _nearTextQuery(collection, search_question, limit, return_fields, filter_property, auto_limit)
+
+        if cache_key is not None:
+            search_cache.put(cache_key, result, cache_generation)
+        return result
 
     except Exception as ex:
         raise
@@ -392,14 +876,110 @@ def searchWithNearObject(weaviate_configs, class_name, uuid, limit, return_field
     try:
         # Using Content manager to initiate the client as it will close the connection automatically
         with WeaviateConnectionManager(weaviate_configs) as client:
-            filters = Filter.by_property(filter_property).not_equal("OBJ_TEMP") if filter_property else None #filter temporary objects from similar objects results
             collection = client.collections.get(class_name)
-            response = collection.query.near_object(
-                near_object=uuid,
-                limit=limit,
-                filters=filters
+            return _nearObjectQuery(collection, uuid, limit, return_fields, filter_property)
+
+    except Exception as ex:
+        raise
+
+def _nearTextQuery(collection, search_question, limit, return_fields, filter_property, auto_limit):
+    filters = Filter.by_property(filter_property).not_equal("OBJ_TEMP") if filter_property else None #filter temporary objects from search results
+    response = collection.query.near_text(
+        query=search_question,
+        limit=limit,
+        auto_limit=auto_limit,
+        filters=filters
+    )
+    return getResponseData(response.objects, return_fields)
+
+def _nearObjectQuery(collection, uuid, limit, return_fields, filter_property):
+    filters = Filter.by_property(filter_property).not_equal("OBJ_TEMP") if filter_property else None #filter temporary objects from similar objects results
+    response = collection.query.near_object(
+        near_object=uuid,
+        limit=limit,
+        filters=filters
+    )
+    return getResponseData(response.objects, return_fields)
+
+# Search many texts at once in Class or Collection
+def searchWithTextBatch(weaviate_configs, class_name, search_questions, limit, return_fields, filter_property, auto_limit):
+    """
+    Runs many `searchWithText` queries concurrently over one pooled connection.
+
+    Total wall time approaches that of the slowest single query instead of the sum of all of them.
+
+    Args:
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+        class_name (str): The name of the class or collection to search within.
+        search_questions (list): The texts to search for.
+        limit, return_fields, filter_property, auto_limit: As in `searchWithText`, applied to every query.
+
+    Returns:
+        list: One result list per search question, in input order.
+
+    Example:
+        results = searchWithTextBatch(weaviate_configs, "Article", ["machine learning", "databases"], 5, "title", "brief_id", None)
+        # results[0] holds the matches for "machine learning", results[1] for "databases"
+    """
+
+    results = [None] * len(search_questions)
+    cache_keys = [None] * len(search_questions)
+    cache_generation = None
+    if search_cache is not None:
+        for index, search_question in enumerate(search_questions):
+            cache_keys[index] = search_cache.makeKey(weaviate_configs, class_name, search_question, limit, return_fields, filter_property, auto_limit)
+            if cache_generation is None:
+                cache_generation = search_cache.generation(cache_keys[index])
+            results[index] = search_cache.get(cache_keys[index])
+
+    missing = [index for index, result in enumerate(results) if result is None]
+    if not missing:
+        return results
+
+    try:
+        # Using Content manager to initiate the client as it will close the connection automatically
+        with WeaviateConnectionManager(weaviate_configs) as client:
+            collection = client.collections.get(class_name)
+            missing_results = search_executor.map(
+                lambda index: _nearTextQuery(collection, search_questions[index], limit, return_fields, filter_property, auto_limit),
+                missing
             )
-            return getResponseData(response.objects, return_fields)
+            for index, result in zip(missing, missing_results):
+                results[index] = result
+                if cache_keys[index] is not None:
+                    search_cache.put(cache_keys[index], result, cache_generation)
+
+        return results
+
+    except Exception as ex:
+        raise
+
+# Search near/similar objects for many uuids at once in Class or Collection
+def searchWithNearObjectBatch(weaviate_configs, class_name, uuids, limit, return_fields, filter_property):
+    """
+    Runs many `searchWithNearObject` queries concurrently over one pooled connection.
+
+    Args:
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+        class_name (str): The name of the class or collection to search within.
+        uuids (list): The UUIDs of the objects to find similar objects for.
+        limit, return_fields, filter_property: As in `searchWithNearObject`, applied to every query.
+
+    Returns:
+        list: One result list per UUID, in input order.
+
+    Example:
+        results = searchWithNearObjectBatch(weaviate_configs, "Article", [uuid_a, uuid_b], 5, "title", "brief_id")
+    """
+
+    try:
+        # Using Content manager to initiate the client as it will close the connection automatically
+        with WeaviateConnectionManager(weaviate_configs) as client:
+            collection = client.collections.get(class_name)
+            return list(search_executor.map(
+                lambda uuid: _nearObjectQuery(collection, uuid, limit, return_fields, filter_property),
+                uuids
+            ))
 
     except Exception as ex:
         raise
@@ -533,24 +1113,147 @@ def addUpdateChildObject(weaviate_configs, class_name_parent, class_name_child,
 			- message (str): A message about the result of the creation process.
 	"""
 
-	try:
-		# Using Content manager to initiate the client as it will close the connection automatically
-		with WeaviateConnectionManager(weaviate_configs) as client:
-			collection = client.collections.get(class_name_child)
-			uuid = child_uuid
-			if child_uuid:
-				collection.data.update(
-					uuid=child_uuid,
-					properties=object_data,
-				)
-			else:
-				uuid = collection.data.insert( properties=object_data)
-
-				# Update cross reference for newly created object
-				if uuid:
-					UpdateObjectCrossReference(weaviate_configs, class_name_child, uuid, class_name_parent, uuid_parent, parent_id_field, parent_id, cross_reference_field) 
-			message = api_entities.DATA_SAVED_MESSAGE.format(class_name_child)
-			return message, uuid
-
-	except Exception as ex:
-		raise
+	item = {
+		"uuid_parent": uuid_parent,
+		"parent_id": parent_id,
+		"parent_id_field": parent_id_field,
+		"object_data": object_data,
+		"child_uuid": child_uuid,
+	}
+	message, results = addUpdateChildObjects(weaviate_configs, class_name_parent, class_name_child, cross_reference_field, [item])
+	if results[0]["error"]:
+		raise Exception(results[0]["error"])
+
+	message = api_entities.DATA_SAVED_MESSAGE.format(class_name_child)
+	return message, results[0]["uuid"]
+
+# Create / update many child objects in Class or Collection and batch their cross-references
+def addUpdateChildObjects(weaviate_configs, class_name_parent, class_name_child, cross_reference_field, items):
+    """
+    Upsert many child objects and link the new ones to their parents in batched passes.
+
+    Parents are resolved first; new children whose parent does not exist are reported with
+    an error and not inserted. The rest are inserted with `collection.batch` and their
+    cross-references added in a single batched reference pass, so the import costs a few
+    round trips rather than two per child. Existing children (items with a `child_uuid`) are
+    updated in place and keep their references.
+
+    Args:
+        weaviate_configs (dict): Configuration dictionary containing Weaviate connection parameters.
+        class_name_parent (str): The name of the class or collection of the parent objects.
+        class_name_child (str): The name of the class or collection of the child objects.
+        cross_reference_field (str): Name of the cross-reference field in the child objects.
+        items (list): A list of dictionaries, one per child, with the keys
+            - object_data (dict): The child object data.
+            - child_uuid (str, optional): UUID of an existing child to update instead of inserting.
+            - uuid_parent (str, optional): UUID of the parent object.
+            - parent_id, parent_id_field (optional): Used to find the parent when `uuid_parent` is not given.
+
+    Returns:
+        tuple: A message indicating the status and a list with one `{"uuid": str, "error": str | None}`
+               per item, in input order. `uuid` is None for new children that were not inserted.
+
+    Example:
+        message, results = addUpdateChildObjects(weaviate_configs, "Briefs", "BriefChildren", "brief_parent", [
+            {"uuid_parent": "4a242d70-2f67-4983-8860-3c64cf8b33b0", "object_data": {"field1": "value1"}},
+            {"parent_id": 123, "parent_id_field": "brief_id", "object_data": {"field1": "value2"}},
+        ])
+    """
+
+    results = [{"uuid": item.get("child_uuid"), "error": None} for item in items]
+
+    try:
+        # Using Content manager to initiate the client as it will close the connection automatically
+        with WeaviateConnectionManager(weaviate_configs) as client:
+            collection = client.collections.get(class_name_child)
+            parent_collection = client.collections.get(class_name_parent)
+
+            # Update existing children in place
+            for index, item in enumerate(items):
+                if item.get("child_uuid"):
+                    try:
+                        collection.data.update(
+                            uuid=item["child_uuid"],
+                            properties=item["object_data"],
+                        )
+                    except Exception as ex:
+                        results[index]["error"] = str(ex)
+
+            new_indexes = [index for index, item in enumerate(items) if not item.get("child_uuid")]
+            if not new_indexes:
+                _invalidateSearchCache(weaviate_configs, class_name_child)
+                return api_entities.ALL_DATA_SAVED_MESSAGE.format(class_name_child), results
+
+            # Resolve parent UUIDs, querying each distinct parent id only once
+            parent_uuids = {}
+            for index in new_indexes:
+                item = items[index]
+                if item.get("uuid_parent") or not item.get("parent_id_field"):
+                    continue
+                parent_key = (item["parent_id_field"], item.get("parent_id"))
+                if parent_key not in parent_uuids:
+                    response = parent_collection.query.fetch_objects(
+                        filters=Filter.by_property(item["parent_id_field"]).equal(item.get("parent_id")),
+                        limit=1,
+                    )
+                    parent_uuids[parent_key] = str(response.objects[0].uuid) if response.objects else None
+
+            # Check each distinct parent UUID given directly exists
+            parent_exists = {}
+            for index in new_indexes:
+                uuid_parent = items[index].get("uuid_parent")
+                if uuid_parent and uuid_parent not in parent_exists:
+                    parent_exists[uuid_parent] = parent_collection.data.exists(uuid_parent)
+
+            # Only children whose parent is known are inserted, so a retry of the failed
+            # items cannot leave orphans or duplicates behind
+            parent_by_index = {}
+            for index in new_indexes:
+                item = items[index]
+                uuid_parent = item.get("uuid_parent")
+                if uuid_parent and not parent_exists[uuid_parent]:
+                    uuid_parent = None
+                elif not uuid_parent and item.get("parent_id_field"):
+                    uuid_parent = parent_uuids.get((item["parent_id_field"], item.get("parent_id")))
+                if uuid_parent:
+                    parent_by_index[index] = uuid_parent
+                else:
+                    results[index]["error"] = "Parent object not found"
+            new_indexes = [index for index in new_indexes if index in parent_by_index]
+
+            # Insert the new children in one batch with client-side UUIDs
+            for index in new_indexes:
+                results[index]["uuid"] = str(uuid4())
+
+            with collection.batch.dynamic() as batch:
+                for index in new_indexes:
+                    batch.add_object(
+                        properties=items[index]["object_data"],
+                        uuid=results[index]["uuid"],
+                    )
+
+            index_by_uuid = {results[index]["uuid"]: index for index in new_indexes}
+            for failed in collection.batch.failed_objects:
+                results[index_by_uuid[str(failed.object_.uuid)]]["error"] = failed.message
+
+            # Add every cross-reference in a single batched reference pass
+            with collection.batch.dynamic() as batch:
+                for index in new_indexes:
+                    if results[index]["error"]:
+                        continue
+
+                    batch.add_reference(
+                        from_uuid=results[index]["uuid"],
+                        from_property=cross_reference_field,
+                        to=parent_by_index[index],
+                    )
+
+            for failed in collection.batch.failed_references:
+                results[index_by_uuid[str(failed.reference.from_uuid)]]["error"] = failed.message
+            _invalidateSearchCache(weaviate_configs, class_name_child)
+
+            message = api_entities.ALL_DATA_SAVED_MESSAGE.format(class_name_child)
+            return message, results
+
+    except Exception as ex:
+        raise
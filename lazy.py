@@ -0,0 +1,107 @@
+import importlib
+import logging
+import threading
+
+from telemetry import log_event
+
+log = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """ Stands in for a module until one of its attributes is used, then imports it.
+
+    Keeps heavy SDKs out of the import of the app, so a worker can start serving
+    before they are needed.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+class LazySingleton:
+    """ An object built by factory on first use, once per process, and shared afterwards.
+
+    Attribute access is forwarded to the built object, so it can stand in for it.
+    A factory that raises is retried on next use; the error is kept for readiness().
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._value = None
+        self._ready = False
+        self._error = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready
+
+    @property
+    def error(self):
+        return self._error
+
+    def instance(self):
+        if self._ready:
+            return self._value
+        with self._lock:
+            if not self._ready:
+                try:
+                    self._value = self._factory()
+                except Exception as e:
+                    self._error = e
+                    raise
+                self._error = None
+                self._ready = True
+                log_event(log, 'client initialized', name=self.name)
+        return self._value
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self.instance(), attr)
+
+
+def readiness(singletons):
+    """ {name: 'ready' | 'pending' | 'failed: error'} without building anything """
+    status = {}
+    for singleton in singletons:
+        if singleton.ready:
+            status[singleton.name] = 'ready'
+        elif singleton.error is not None:
+            status[singleton.name] = f"failed: {singleton.error}"
+        else:
+            status[singleton.name] = 'pending'
+    return status
+
+
+def preload(singletons):
+    """ Build the singletons one after another in a background thread """
+    def run():
+        for singleton in singletons:
+            try:
+                singleton.instance()
+            except Exception as e:
+                log_event(log, 'preloading client failed', logging.WARNING, name=singleton.name, error=str(e))
+
+    thread = threading.Thread(target=run, name='preload', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,322 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from telemetry import log_event
+
+log = logging.getLogger(__name__)
+
+POLICY_CHEAPEST = 'cheapest'
+POLICY_FASTEST = 'fastest'
+POLICY_STICKY = 'sticky'
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class LLMBackend:
+    """ One model the router can send a request to.
+
+    generate(request) returns the whole answer, stream(request) yields its text chunks.
+    can_serve(request) tells whether the backend can answer that request at all,
+    e.g. the local model cannot read a file uploaded to Gemini.
+    """
+
+    def __init__(self, name, generate, stream, cost=1.0, can_serve=None):
+        self.name = name
+        self.generate = generate
+        self.stream = stream
+        self.cost = cost
+        self.can_serve = can_serve or (lambda request: True)
+
+
+class BackendStats:
+    """ Rolling latency and error rate of a backend over its last window calls.
+
+    Latency is the time until the user sees output: the whole answer for generate,
+    the first chunk for stream.
+    """
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency=None, ok=True):
+        with self._lock:
+            if latency is not None:
+                self._latencies.append(latency)
+            self._outcomes.append(ok)
+
+    def samples(self):
+        with self._lock:
+            return len(self._outcomes)
+
+    def percentile(self, q):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q / 100 * len(latencies)))]
+
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return self._outcomes.count(False) / len(self._outcomes)
+
+    def snapshot(self):
+        return {
+            'samples': self.samples(),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'error_rate': self.error_rate(),
+        }
+
+
+class LLMRouter:
+    """ Routes each request over several backends and bounds how long it can take.
+
+    Backends are ordered by policy: 'cheapest' by cost, 'fastest' by p50 latency and
+    'sticky' keeps a conversation on the backend that last answered it. Backends whose
+    error rate is over max_error_rate go last. When the first backend fails the next one
+    is tried right away; when it has not answered within the deadline (or its own p95,
+    once known) the next one is started alongside it and whichever answers first wins.
+    The deadline counts from when a backend call starts, not from when it was queued.
+
+    Every backend call runs on its own thread unless max_workers caps them to a pool.
+    """
+
+    def __init__(self, backends, policy=POLICY_CHEAPEST, deadline=30, min_hedge_delay=2,
+                 max_error_rate=0.5, min_samples=10, max_workers=None, max_sticky=1024):
+        self.backends = OrderedDict((backend.name, backend) for backend in backends)
+        self.policy = policy
+        self.deadline = deadline
+        self.min_hedge_delay = min_hedge_delay
+        self.max_error_rate = max_error_rate
+        self.min_samples = min_samples
+        self.max_sticky = max_sticky
+
+        self.stats = {name: BackendStats() for name in self.backends}
+        self._sticky = OrderedDict()  # conversation_id -> backend name
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-router') if max_workers else None
+
+    def candidates(self, request, conversation_id=None, preferred=None):
+        """ The backends able to serve request, in the order they should be tried """
+        backends = [backend for backend in self.backends.values() if self._can_serve(backend, request)]
+
+        if self.policy == POLICY_FASTEST:
+            # Backends without measurements go first so they get some
+            backends.sort(key=lambda backend: (self.stats[backend.name].percentile(50) or 0, backend.cost))
+        else:
+            backends.sort(key=lambda backend: backend.cost)
+
+        if self.policy == POLICY_STICKY and conversation_id:
+            with self._lock:
+                preferred = preferred or self._sticky.get(conversation_id)
+        if preferred:
+            backends.sort(key=lambda backend: backend.name != preferred)
+
+        backends.sort(key=lambda backend: not self._healthy(backend))
+        return backends
+
+    def generate(self, request, conversation_id=None, preferred=None, deadline=None):
+        """ The answer of the first backend to succeed, and that backend's name """
+        remaining = self.candidates(request, conversation_id, preferred)
+        if not remaining:
+            raise NoBackendAvailable('No backend can serve this request')
+        deadline = deadline or self.deadline
+
+        running = {}
+        started = {}
+        last_error = None
+
+        def launch():
+            backend = remaining.pop(0)
+            running[self._submit(self._timed_generate, backend, request, started)] = backend
+            return backend
+
+        current = launch()
+        while running:
+            timeout = self._hedge_timeout(current, deadline, started) if remaining else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if self._hedge_timeout(current, deadline, started) > 0:
+                    continue
+                log_event(log, 'backend past its deadline, hedging', logging.WARNING, backend=current.name)
+                current = launch()
+                continue
+
+            for future in done:
+                backend = running.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    log_event(log, 'backend failed', logging.WARNING, backend=backend.name, error=str(e))
+                    last_error = e
+                    continue
+                self._remember(conversation_id, backend)
+                return response, backend.name
+
+            if not running and remaining:
+                current = launch()
+
+        raise last_error
+
+    def stream(self, request, conversation_id=None, preferred=None, deadline=None, on_backend=None):
+        """ Yield the text chunks of the first backend to start answering.
+
+        Failover and hedging only happen before the first chunk; once a backend has
+        started streaming it is the one that finishes the answer. on_backend is called
+        with the name of that backend.
+        """
+        remaining = self.candidates(request, conversation_id, preferred)
+        if not remaining:
+            raise NoBackendAvailable('No backend can serve this request')
+        deadline = deadline or self.deadline
+
+        events = queue.Queue()
+        state = {'winner': None, 'closed': False}
+        started = {}
+        active = [0]
+        last_error = None
+
+        def pump(backend):
+            start = started[backend.name] = time.monotonic()
+            latency = None
+            try:
+                for text in backend.stream(request):
+                    if latency is None:
+                        latency = time.monotonic() - start
+                    if state['closed'] or state['winner'] not in (None, backend):
+                        break
+                    events.put((backend, 'token', text))
+                else:
+                    events.put((backend, 'done', None))
+            except Exception as e:
+                self.stats[backend.name].record(latency, ok=False)
+                events.put((backend, 'error', e))
+                return
+            self.stats[backend.name].record(latency if latency is not None else time.monotonic() - start)
+
+        def launch():
+            backend = remaining.pop(0)
+            active[0] += 1
+            self._submit(pump, backend)
+            return backend
+
+        current = launch()
+        try:
+            while True:
+                timeout = self._hedge_timeout(current, deadline, started) if state['winner'] is None and remaining else None
+                try:
+                    backend, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    if self._hedge_timeout(current, deadline, started) > 0:
+                        continue
+                    log_event(log, 'backend past its deadline, hedging', logging.WARNING, backend=current.name)
+                    current = launch()
+                    continue
+
+                if state['winner'] is None:
+                    if kind == 'error':
+                        log_event(log, 'backend failed', logging.WARNING, backend=backend.name, error=str(value))
+                        last_error = value
+                        active[0] -= 1
+                        if remaining:
+                            current = launch()
+                        elif active[0] == 0:
+                            raise last_error
+                        continue
+                    state['winner'] = backend
+                    self._remember(conversation_id, backend)
+                    if on_backend is not None:
+                        on_backend(backend.name)
+
+                if backend is not state['winner']:
+                    continue
+                if kind == 'token':
+                    yield value
+                elif kind == 'done':
+                    return
+                else:
+                    raise value
+        finally:
+            state['closed'] = True
+
+    def snapshot(self):
+        return {
+            'policy': self.policy,
+            'deadline': self.deadline,
+            'backends': {name: stats.snapshot() for name, stats in self.stats.items()},
+        }
+
+    def _submit(self, function, *args):
+        # Run in the caller's context so the work shows up in its request trace
+        context = contextvars.copy_context()
+        if self._executor is not None:
+            return self._executor.submit(context.run, function, *args)
+
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(context.run(function, *args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name='llm-router', daemon=True).start()
+        return future
+
+    def _timed_generate(self, backend, request, started):
+        start = started[backend.name] = time.monotonic()
+        try:
+            response = backend.generate(request)
+        except Exception:
+            self.stats[backend.name].record(ok=False)
+            raise
+        self.stats[backend.name].record(time.monotonic() - start)
+        return response
+
+    def _hedge_timeout(self, backend, deadline, started):
+        """ Seconds left before hedging backend; a call still queued has not used any """
+        delay = self._hedge_delay(backend, deadline)
+        start = started.get(backend.name)
+        if start is None:
+            return delay
+        return max(0.0, start + delay - time.monotonic())
+
+    def _hedge_delay(self, backend, deadline):
+        stats = self.stats[backend.name]
+        p95 = stats.percentile(95)
+        if stats.samples() < self.min_samples or p95 is None:
+            return deadline
+        return min(deadline, max(self.min_hedge_delay, p95))
+
+    def _can_serve(self, backend, request):
+        try:
+            return backend.can_serve(request)
+        except Exception as e:
+            log_event(log, 'backend availability check failed', logging.WARNING, backend=backend.name, error=str(e))
+            return False
+
+    def _healthy(self, backend):
+        stats = self.stats[backend.name]
+        return stats.samples() < self.min_samples or stats.error_rate() <= self.max_error_rate
+
+    def _remember(self, conversation_id, backend):
+        if not conversation_id:
+            return
+        with self._lock:
+            self._sticky[conversation_id] = backend.name
+            self._sticky.move_to_end(conversation_id)
+            while len(self._sticky) > self.max_sticky:
+                self._sticky.popitem(last=False)
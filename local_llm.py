@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from lazy import LazyModule
+from telemetry import log_event
+
+requests = LazyModule('requests')
+requests_adapters = LazyModule('requests.adapters')
+urllib3_retry = LazyModule('urllib3.util.retry')
+
+log = logging.getLogger(__name__)
+
+load_dotenv()
+
+LOCAL_MODEL = "llama3.2:1b"
+LOCAL_EMBED_MODEL = os.getenv('LLM_LOCAL_EMBED_MODEL', 'nomic-embed-text')
+
+# A request counts as a cold start when Ollama spent longer than this loading the model
+COLD_START_THRESHOLD = 1.0
+
+
+class LocalModelStats:
+    """ Load and eval timings from the final chunk of every Ollama generate call.
+    Preloads and keep-alive pings are counted on their own, so requests and cold_starts
+    only cover calls made for users. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.cold_starts = 0
+        self.load_seconds = 0.0
+        self.prompt_eval_count = 0
+        self.prompt_eval_seconds = 0.0
+        self.eval_count = 0
+        self.eval_seconds = 0.0
+        self.preloads = 0
+        self.preload_loads = 0
+        self.preload_load_seconds = 0.0
+        self.last = {}
+
+    def record(self, chunk):
+        # Ollama reports durations in nanoseconds
+        load = chunk.get('load_duration', 0) / 1e9
+        with self._lock:
+            self.requests += 1
+            if load > COLD_START_THRESHOLD:
+                self.cold_starts += 1
+            self.load_seconds += load
+            self.prompt_eval_count += chunk.get('prompt_eval_count', 0)
+            self.prompt_eval_seconds += chunk.get('prompt_eval_duration', 0) / 1e9
+            self.eval_count += chunk.get('eval_count', 0)
+            self.eval_seconds += chunk.get('eval_duration', 0) / 1e9
+            self.last = {
+                'load_seconds': load,
+                'total_seconds': chunk.get('total_duration', 0) / 1e9,
+                'prompt_eval_count': chunk.get('prompt_eval_count', 0),
+                'eval_count': chunk.get('eval_count', 0),
+                'eval_seconds': chunk.get('eval_duration', 0) / 1e9,
+            }
+
+    def record_preload(self, chunk):
+        load = chunk.get('load_duration', 0) / 1e9
+        with self._lock:
+            self.preloads += 1
+            if load > COLD_START_THRESHOLD:
+                self.preload_loads += 1
+            self.preload_load_seconds += load
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'cold_starts': self.cold_starts,
+                'load_seconds': self.load_seconds,
+                'prompt_eval_count': self.prompt_eval_count,
+                'prompt_eval_seconds': self.prompt_eval_seconds,
+                'eval_count': self.eval_count,
+                'eval_seconds': self.eval_seconds,
+                'eval_tokens_per_second': self.eval_count / self.eval_seconds if self.eval_seconds else 0.0,
+                'preloads': self.preloads,
+                'preload_loads': self.preload_loads,
+                'preload_load_seconds': self.preload_load_seconds,
+                'last': dict(self.last),
+            }
+
+
+class LocalModelNotConfigured(Exception):
+    pass
+
+
+class LocalModelClient:
+    """ Client for the local Ollama backend that keeps its connections alive.
+
+    All requests go through one pooled requests.Session, so consecutive messages reuse
+    the TCP/TLS connection to the Ollama (or ngrok) endpoint instead of opening a new
+    one. Failed connections and 502/503/504 answers are retried with backoff.
+
+    base_url may be None when no local model is configured; every call then raises
+    LocalModelNotConfigured.
+    """
+
+    def __init__(self, base_url, model=LOCAL_MODEL, embed_model=LOCAL_EMBED_MODEL,
+                 connect_timeout=10, read_timeout=600, retries=3, pool_size=10, keep_alive='30m'):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.model = model
+        self.embed_model = embed_model
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.stats = LocalModelStats()
+        self._keep_alive_stop = threading.Event()
+        self._keep_alive_thread = None
+
+        # Generate and embed are POSTs that may already be running on the server once the
+        # request is sent, so only connection failures and 502/503/504 are retried
+        retry = urllib3_retry.Retry(
+            total=retries,
+            read=0,
+            other=0,
+            backoff_factor=0.5,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = requests_adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def configured(self):
+        return self.base_url is not None
+
+    def url(self, path):
+        if self.base_url is None:
+            raise LocalModelNotConfigured('No local model is configured, set LLM_LOCAL')
+        return self.base_url + path
+
+    def generate_stream(self, prompt, **options):
+        """ Yield every chunk Ollama's /api/generate sends, the last one has done=True """
+        data = dict(options, model=options.get('model', self.model), prompt=prompt)
+        data.setdefault('keep_alive', self.keep_alive)
+        with self.session.post(self.url('/api/generate'), json=data, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    chunk = json.loads(line.decode('utf-8'))
+                    if chunk.get("done"):
+                        self.stats.record(chunk)
+                    yield chunk
+                    if chunk.get("done"):
+                        break
+
+    def generate(self, prompt, **options):
+        return ''.join(chunk.get("response", "") for chunk in self.generate_stream(prompt, **options))
+
+    def embed(self, texts):
+        response = self.session.post(
+            self.url('/api/embed'),
+            json={"model": self.embed_model, "input": texts},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()["embeddings"]
+
+    def warm_up(self):
+        """ Open a pooled connection ahead of the first message """
+        if not self.configured:
+            return
+        try:
+            self.session.get(self.url('/api/version'), timeout=self.timeout).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            log_event(log, 'local model warm-up failed', logging.WARNING, error=str(e))
+
+    def warm_up_in_background(self):
+        threading.Thread(target=self.warm_up, name='local-model-warm-up', daemon=True).start()
+
+    def preload(self):
+        """ Load the model into memory (or keep it there) with an empty generate """
+        if not self.configured:
+            return
+        try:
+            response = self.session.post(
+                self.url('/api/generate'),
+                json={"model": self.model, "keep_alive": self.keep_alive},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            chunk = response.json()
+            self.stats.record_preload(chunk)
+            load = chunk.get('load_duration', 0) / 1e9
+            if load > COLD_START_THRESHOLD:
+                log_event(log, 'local model loaded', model=self.model, load_seconds=round(load, 2))
+        except requests.exceptions.RequestException as e:
+            log_event(log, 'local model preload failed', logging.WARNING, error=str(e))
+
+    def start_keep_alive(self, interval=300):
+        """ Preload now and then every interval seconds, so users never wait for a cold load.
+        interval should stay below keep_alive. """
+        if self._keep_alive_thread is not None or not self.configured:
+            return
+
+        def run():
+            while True:
+                self.preload()
+                if self._keep_alive_stop.wait(interval):
+                    break
+
+        self._keep_alive_thread = threading.Thread(target=run, name='local-model-keep-alive', daemon=True)
+        self._keep_alive_thread.start()
+
+    def stop_keep_alive(self):
+        self._keep_alive_stop.set()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def local_model_configured():
+    """ Whether LLM_LOCAL points at a local model, without building the client """
+    return bool(os.getenv("LLM_LOCAL"))
+
+def get_local_model_client():
+    """ The process-wide client, configured once from LLM_LOCAL (None without a local model) """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = LocalModelClient(
+                os.getenv("LLM_LOCAL"),
+                connect_timeout=float(os.getenv('LLM_LOCAL_CONNECT_TIMEOUT', 10)),
+                read_timeout=float(os.getenv('LLM_LOCAL_READ_TIMEOUT', 600)),
+                retries=int(os.getenv('LLM_LOCAL_RETRIES', 3)),
+                keep_alive=os.getenv('LLM_LOCAL_KEEP_ALIVE', '30m'),
+            )
+        return _client
@@ -1,10 +1,9 @@
 import requests
-import json  
+from local_llm import get_local_model_client
 
-url = "https://bf01-34-142-255-125.ngrok-free.app/api/generate" 
-data = {
-    "model": "llama3.2:1b",
-    "prompt": "another one",
+client = get_local_model_client()
+prompt = "another one"
+options = {
     "conversation": [
         {"role": "user", "content": "tell me a joke"},
         {"role": "assistant", "content": "Why scientist dont trust atoms? Because they make up everything"}
@@ -12,19 +11,10 @@ data = {
 }
 
 try:
-    response = requests.post(url, json=data, stream=True)  # Use stream=True for chunked responses
-    response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-
-    full_text = ''
-    for chunk in response.iter_lines():
-        if chunk:
-            data = json.loads(chunk.decode('utf-8'))  # Corrected json usage
-            full_text += data.get("response", "")
-            if data.get("done"):
-                break
+    # Reuses the pooled session, so repeated calls keep the connection alive
+    full_text = client.generate(prompt, **options)
     print(full_text)
 
 except requests.exceptions.RequestException as e:
     print(f"An error occurred: {e}")
 
-
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from lazy import LazyModule
+from telemetry import log_event
+
+np = LazyModule('numpy')
+
+log = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt):
+    """ Questions differing only in case, spacing or final punctuation share an entry """
+    return ' '.join((prompt or '').lower().split()).rstrip('?.! ')
+
+
+def context_key(context):
+    """ Fingerprint of the conversation turns sent ahead of the question """
+    if not context:
+        return ''
+    return hashlib.sha256(json.dumps(list(context)).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """ Answers of the model keyed by (model, file, normalized prompt, prior context).
+
+    An exact entry only matches the same earlier turns, so a multi-turn conversation
+    never gets an answer given in a different context. Questions asked without earlier
+    turns also get a semantic tier: with an embed function, the question's vector is
+    compared against the cached questions on the same model and file, and an answer
+    is reused when their cosine similarity reaches similarity_threshold.
+
+    Entries expire after ttl seconds and the least recently used ones are dropped once
+    there are more than max_entries.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, similarity_threshold=0.95, embed=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.embed = embed
+
+        self._entries = OrderedDict()  # key -> entry
+        self._groups = {}  # (model, file_key) -> {'keys': [...], 'matrix': unit vectors or None}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def vector_for(self, prompt, context=None):
+        """ The question's unit vector for the semantic tier, None when it does not apply """
+        if self.embed is None or context:
+            return None
+        try:
+            vector = np.asarray(self.embed([normalize_prompt(prompt)])[0], dtype=np.float32)
+        except Exception as e:
+            log_event(log, 'embedding the question for the response cache failed', logging.WARNING, error=str(e))
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def get(self, models, file_key, prompt, context=None):
+        """ (response, model) of the first of models with a usable entry or None, and the
+        question's vector to hand to put(). The question is only embedded for the semantic
+        tier once no exact entry matched. """
+        if self.max_entries <= 0:
+            return None, None
+
+        now = time.monotonic()
+        with self._lock:
+            for model in models:
+                key = self._key(model, file_key, prompt, context)
+                entry = self._live_entry(key, now)
+                if entry is not None:
+                    self.hits += 1
+                    return (entry['response'], entry['model']), None
+
+        vector = self.vector_for(prompt, context)
+        with self._lock:
+            if vector is not None:
+                for model in models:
+                    key = self._nearest(model, file_key, vector, now)
+                    if key is not None:
+                        entry = self._entries[key]
+                        self._entries.move_to_end(key)
+                        self.semantic_hits += 1
+                        return (entry['response'], entry['model']), vector
+
+            self.misses += 1
+            return None, vector
+
+    def put(self, model, file_key, prompt, response, context=None, vector=None):
+        if self.max_entries <= 0 or not response:
+            return
+
+        key = self._key(model, file_key, prompt, context)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = {
+                'model': model,
+                'group': (model, file_key),
+                'response': response,
+                'expires': time.monotonic() + self.ttl,
+                'vector': vector if not context else None,
+            }
+            if self._entries[key]['vector'] is not None:
+                group = self._groups.setdefault((model, file_key), {'keys': [], 'matrix': None})
+                group['keys'].append(key)
+                group['matrix'] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+            }
+
+    @staticmethod
+    def _key(model, file_key, prompt, context):
+        raw = json.dumps([model, file_key, normalize_prompt(prompt), context_key(context)])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _live_entry(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires'] <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, model, file_key, vector, now):
+        group = self._groups.get((model, file_key))
+        if group is None:
+            return None
+
+        for key in [key for key in group['keys'] if self._entries[key]['expires'] <= now]:
+            self._remove(key)
+        if not group['keys']:
+            return None
+
+        if group['matrix'] is None:
+            group['matrix'] = np.stack([self._entries[key]['vector'] for key in group['keys']])
+        if group['matrix'].shape[1] != vector.shape[0]:
+            return None
+
+        scores = group['matrix'] @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        return group['keys'][best]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry['vector'] is None:
+            return
+        group = self._groups.get(entry['group'])
+        if group is not None and key in group['keys']:
+            group['keys'].remove(key)
+            group['matrix'] = None
+            if not group['keys']:
+                del self._groups[entry['group']]
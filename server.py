@@ -1,42 +1,69 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Blueprint, render_template, request, jsonify, Response, stream_with_context, g
+import argparse
+import logging
 import threading
-import google.generativeai as genai
 import time
 from dotenv import load_dotenv
 import os
-import firebase_admin
-from firebase_admin import credentials, firestore
 import uuid
 from uuid import uuid4
-from datetime import datetime, timezone
-import markdown
-import html
-import requests
+from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
+import hashlib
+import mmap
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import json
 from dotenv import load_dotenv
 load_dotenv()
 
-from llama_parse import LlamaParse
-from llama_index.core import SimpleDirectoryReader
-
-def start():
+from lazy import LazyModule, LazySingleton, preload, readiness
+
+# Heavy SDKs are imported on first use, not when a worker starts
+genai = LazyModule('google.generativeai')
+firebase_admin = LazyModule('firebase_admin')
+credentials = LazyModule('firebase_admin.credentials')
+firestore = LazyModule('firebase_admin.firestore')
+requests = LazyModule('requests')
+np = LazyModule('numpy')
+llama_parse = LazyModule('llama_parse')
+llama_index_core = LazyModule('llama_index.core')
+
+from chat_repository import ChatHistoryRepository, SCHEMA_TURNS, valid_turn_cursor
+from context_store import ConversationContextStore
+from file_watcher import FileStateWatcher
+from local_llm import get_local_model_client, local_model_configured, LOCAL_EMBED_MODEL
+from llm_router import LLMBackend, LLMRouter
+from response_cache import ResponseCache
+import telemetry
+from telemetry import log_event, span
+
+telemetry.configure_logging()
+log = logging.getLogger(__name__)
+
+local_model_client = LazySingleton('local model client', get_local_model_client)
+
+SYSTEM_INSTRUCTION = [
+    "Carefully go through the entire code files provided",
+    "Analyze the files thoroughly considering all minor details before responding ",
+    "Answer the questions asked related to file shortly and precisely",
+    "Consider the chat context before responding, but don't include the previous responses while responding. ONly respond the current question being asked, while keeping the conversation context thoroughly in consideration",
+    "when asked to return code, only return code with minor related explanation of key concepts if required"
+]
+
+def start(model_name="gemini-1.5-flash-8b"):
     load_dotenv()    
-    print ('--- INITIALIZING MODEL ---')
+    log_event(log, 'initializing model', model=model_name)
     
     KEY = os.getenv('GEMINI_API_KEY')
 
     genai.configure(api_key=KEY)
 
     model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash-8b",
+        model_name=model_name,
         # model_name="gemini-1.5-pro-latest",
-        system_instruction=[
-            "Carefully go through the entire code files provided",
-            "Analyze the files thoroughly considering all minor details before responding ",
-            "Answer the questions asked related to file shortly and precisely",
-            "Consider the chat context before responding, but don't include the previous responses while responding. ONly respond the current question being asked, while keeping the conversation context thoroughly in consideration",
-            "when asked to return code, only return code with minor related explanation of key concepts if required"
-        ],
+        system_instruction=SYSTEM_INSTRUCTION,
         # system_instruction=[
         #     "You are a helpful transcriber that can accurately transcribe text from images and PDFs. and videos",
         #     "Your mission is to transcribe text from the provided PDF, image or any other kind of files",
@@ -47,76 +74,423 @@ def start():
     )
     return model
 
+FILE_CACHE_SIZE = 128
+FILE_EXPIRY_MARGIN = timedelta(minutes=5)
+
+# In-process LRU of uploaded Gemini files keyed by the sha256 of their bytes
+file_cache = OrderedDict()
+file_cache_lock = threading.Lock()
+
+def file_sha256(path):
+    """ Hash the file contents so identical bytes map to the same upload """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def is_file_usable(expiry):
+    """ An uploaded file can be reused until shortly before Gemini expires it """
+    return expiry is None or expiry > datetime.now(timezone.utc) + FILE_EXPIRY_MARGIN
+
+def get_cached_file(sha256):
+    with file_cache_lock:
+        uploaded_file = file_cache.get(sha256)
+        if uploaded_file is None:
+            return None
+        if not is_file_usable(uploaded_file.expiration_time):
+            del file_cache[sha256]
+            return None
+        file_cache.move_to_end(sha256)
+        return uploaded_file
+
+def cache_file(sha256, uploaded_file):
+    with file_cache_lock:
+        file_cache[sha256] = uploaded_file
+        file_cache.move_to_end(sha256)
+        while len(file_cache) > FILE_CACHE_SIZE:
+            file_cache.popitem(last=False)
+
+def evict_cached_file(sha256):
+    with file_cache_lock:
+        file_cache.pop(sha256, None)
+
+FILE_POLL_INITIAL = float(os.getenv('FILE_POLL_INITIAL', 0.5))
+FILE_POLL_MAX = float(os.getenv('FILE_POLL_MAX', 10))
+FILE_PROCESSING_DEADLINE = int(os.getenv('FILE_PROCESSING_DEADLINE', 600))
+
+# One poller for every upload waiting on Gemini, however many requests wait on them
+file_watcher = FileStateWatcher(
+    lambda name: genai.get_file(name),
+    initial_delay=FILE_POLL_INITIAL,
+    max_delay=FILE_POLL_MAX,
+    deadline=FILE_PROCESSING_DEADLINE
+)
+
+def settle(result, future):
+    """ Resolve result with the outcome of future, following it when it produced another Future """
+    def done(finished):
+        try:
+            value = finished.result()
+        except Exception as e:
+            result.set_exception(e)
+            return
+        if isinstance(value, Future):
+            value.add_done_callback(done)
+        else:
+            result.set_result(value)
+    future.add_done_callback(done)
+    return result
+
+def submit_chained(executor, fn, *args):
+    """ Run fn on executor. The returned Future follows any Future fn hands back, so a
+    step that waits on Gemini returns one instead of holding the worker. """
+    return settle(Future(), executor.submit(fn, *args))
+
+def when_done(future, fn, *args):
+    """ Future of fn(future, *args), run on the ingest pool once future has finished """
+    result = Future()
+    def done(finished):
+        try:
+            settle(result, ingest_executor.submit(fn, finished, *args))
+        except RuntimeError as e:
+            # The pool is shut down at exit
+            result.set_exception(e)
+    future.add_done_callback(done)
+    return result
+
 def processFile(file_name, path_input, storage_name):
+    """ The Gemini file for an attachment, or a Future of it while a new upload is processed.
+    A failure is retried once with a fresh upload on the ingest pool. """
+    sha256 = None
     try:
         if storage_name is None:
-            records = get_record_by_name(file_name)
+            sha256 = file_sha256(path_input)
+            cached_file = get_cached_file(sha256)
+            if cached_file:
+                log_event(log, 'file cache hit', logging.DEBUG, storage_name=cached_file.name)
+                return cached_file
+
+            with span('firestore_read'):
+                records = get_record_by_hash(sha256)
             if records:
-                print("\n\n existing \n\n\n")
+                log_event(log, 'file already uploaded', logging.DEBUG, storage_name=records[0]['storage_name'])
                 storage_name = records[0]['storage_name']
             if storage_name is None:
-                print("\n\n new \n\n\n\n")
-                uploaded_file = genai.upload_file(path=path_input)
-                print(uploaded_file)
-
-                while uploaded_file.state != 2:
-                    print(uploaded_file.state)
-                    time.sleep(1)
-                    uploaded_file = genai.get_file(uploaded_file.name)
-                storage_name = uploaded_file.name
-                add_record_file(uploaded_file.display_name, uploaded_file.name, uploaded_file.state, uploaded_file.expiration_time)
+                with span('upload'):
+                    uploaded_file = genai.upload_file(path=path_input)
+                log_event(log, 'file uploaded', storage_name=uploaded_file.name, display_name=uploaded_file.display_name)
 
-                print(uploaded_file)
+                return when_done(file_watcher.watch(uploaded_file), file_active, file_name, path_input, sha256)
 
-        pdfFile = genai.get_file(storage_name)
-        print(f"File URI: {pdfFile.uri}")
+        with span('get_file'):
+            pdfFile = genai.get_file(storage_name)
+        log_event(log, 'file ready', logging.DEBUG, storage_name=pdfFile.name, uri=pdfFile.uri)
 
         # print('\n\n\n\n\n  pdfFile got \n\n\n\n\n\n', pdfFile, '\n\n\n\n\n\n\n\n')
 
+        if sha256:
+            cache_file(sha256, pdfFile)
+
         return pdfFile
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return retryProcessFile(file_name, path_input) 
+        log_event(log, 'file processing failed, retrying', logging.WARNING, file_name=file_name, error=str(e))
+        return submit_chained(ingest_executor, retryProcessFile, file_name, path_input)
+
+def file_active(watched, file_name, path_input, sha256):
+    """ Record a new upload once the watcher reports it ACTIVE """
+    try:
+        uploaded_file = watched.result()
+        add_record_file(uploaded_file.display_name, uploaded_file.name, uploaded_file.state, uploaded_file.expiration_time, sha256)
+    except Exception as e:
+        log_event(log, 'file processing failed, retrying', logging.WARNING, file_name=file_name, error=str(e))
+        return retryProcessFile(file_name, path_input)
+
+    cache_file(sha256, uploaded_file)
+    log_event(log, 'file ready', logging.DEBUG, storage_name=uploaded_file.name, uri=uploaded_file.uri)
+    return uploaded_file
 
 def retryProcessFile(file_name, path_input):
-    print(f"Handling error for file: {file_name}, retrying...")
 
     try:
-        file_mark_expired(file_name)
-        uploaded_file = genai.upload_file(path=path_input)
-        print(uploaded_file)
-
-        while uploaded_file.state != 2:
-            print(uploaded_file.state)
-            time.sleep(1)
-            uploaded_file = genai.get_file(uploaded_file.name)
-        
-        storage_name = uploaded_file.name
-        add_record_file(uploaded_file.display_name, uploaded_file.name, uploaded_file.state, uploaded_file.expiration_time)
+        sha256 = file_sha256(path_input)
+        evict_cached_file(sha256)
+        file_mark_expired_by_hash(sha256)
+        with span('upload'):
+            uploaded_file = genai.upload_file(path=path_input)
+    except Exception as retry_error:
+        log_event(log, 'file upload retry failed', logging.ERROR, file_name=file_name, error=str(retry_error))
+        return None
+
+    return when_done(file_watcher.watch(uploaded_file), retried_file_active, file_name, sha256)
 
-        print(f"Retry successful, file uploaded: {uploaded_file}")
+def retried_file_active(watched, file_name, sha256):
+    try:
+        uploaded_file = watched.result()
+        add_record_file(uploaded_file.display_name, uploaded_file.name, uploaded_file.state, uploaded_file.expiration_time, sha256)
+        cache_file(sha256, uploaded_file)
+
+        log_event(log, 'file uploaded on retry', storage_name=uploaded_file.name, display_name=uploaded_file.display_name)
         return uploaded_file
 
     except Exception as retry_error:
-        print(f"Retry failed: {str(retry_error)}")
+        log_event(log, 'file upload retry failed', logging.ERROR, file_name=file_name, error=str(retry_error))
         return None
 
 
-def parseFile(filepath):
-    # set up parser
-    parser = LlamaParse(
-        result_type="text"
-    )
+CONTEXT_CACHE_ENABLED = os.getenv('CONTEXT_CACHE', '1') == '1'
+CONTEXT_CACHE_TTL = timedelta(seconds=int(os.getenv('CONTEXT_CACHE_TTL', 3600)))
+CONTEXT_CACHE_MIN_TTL = timedelta(minutes=5)
+CONTEXT_CACHE_REFRESH_MARGIN = timedelta(minutes=10)
+CONTEXT_CACHE_RETRY = timedelta(hours=1)
+# Context caching needs a pinned model version
+CONTEXT_CACHE_MODEL_VERSIONS = {
+    'models/gemini-1.5-flash-8b': 'models/gemini-1.5-flash-8b-001',
+    'models/gemini-1.5-pro-latest': 'models/gemini-1.5-pro-002',
+}
+
+# (model, file name, system instruction hash) -> CachedContent holding the file's tokens,
+# shared by every turn and conversation on that file
+context_caches = {}
+context_cache_failures = {}
+context_cache_locks = {}
+context_cache_lock = threading.Lock()
+
+def context_cache_key(gemini_model, uploaded_files):
+    instruction = hashlib.sha256(json.dumps(SYSTEM_INSTRUCTION).encode('utf-8')).hexdigest()
+    return (gemini_model.model_name, tuple(sorted(uploaded_file.name for uploaded_file in uploaded_files)), instruction)
+
+def context_cache_ttl(uploaded_files, now):
+    """ A cache never outlives the files it was built from """
+    ttl = CONTEXT_CACHE_TTL
+    for uploaded_file in uploaded_files:
+        if uploaded_file.expiration_time is not None:
+            ttl = min(ttl, uploaded_file.expiration_time - FILE_EXPIRY_MARGIN - now)
+    return ttl
+
+def context_cache_display_name(uploaded_files):
+    display_name = uploaded_files[0].display_name or uploaded_files[0].name
+    if len(uploaded_files) > 1:
+        display_name += f" (+{len(uploaded_files) - 1} files)"
+    return display_name[:128]
+
+def get_context_cached_model(gemini_model, uploaded_files):
+    """ A model reading uploaded_files from a Gemini context cache, so their tokens are not
+    sent again every turn. None when caching is off or not possible for these files/model. """
+    if not CONTEXT_CACHE_ENABLED:
+        return None
+    version = CONTEXT_CACHE_MODEL_VERSIONS.get(gemini_model.model_name)
+    if version is None:
+        return None
+
+    storage_names = [uploaded_file.name for uploaded_file in uploaded_files]
+    key = context_cache_key(gemini_model, uploaded_files)
+    with context_cache_lock:
+        lock = context_cache_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        now = datetime.now(timezone.utc)
+        failed_date = context_cache_failures.get(key)
+        if failed_date and now - failed_date < CONTEXT_CACHE_RETRY:
+            return None
+
+        ttl = context_cache_ttl(uploaded_files, now)
+        cache = context_caches.get(key)
+        if cache is not None and cache.expire_time <= now + timedelta(seconds=30):
+            cache = None
+        try:
+            if cache is None:
+                if ttl < CONTEXT_CACHE_MIN_TTL:
+                    return None
+                log_event(log, 'creating context cache', storage_names=storage_names, model=version)
+                with span('context_cache'):
+                    cache = genai.caching.CachedContent.create(
+                        model=version,
+                        display_name=context_cache_display_name(uploaded_files),
+                        system_instruction=SYSTEM_INSTRUCTION,
+                        contents=list(uploaded_files),
+                        ttl=ttl
+                    )
+            elif cache.expire_time - now < CONTEXT_CACHE_REFRESH_MARGIN and ttl > cache.expire_time - now:
+                # Still in use, keep it for as long as the file lives
+                cache.update(ttl=ttl)
+        except Exception as e:
+            # e.g. the files are under the minimum token count for caching
+            log_event(log, 'context cache unavailable', logging.WARNING, storage_names=storage_names, error=str(e))
+            context_cache_failures[key] = now
+            context_caches.pop(key, None)
+            return None
+
+        context_caches[key] = cache
+        context_cache_failures.pop(key, None)
+
+    prune_context_caches()
+    return genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+def prune_context_caches():
+    """ Forget caches Gemini has already expired """
+    now = datetime.now(timezone.utc)
+    with context_cache_lock:
+        for key in [key for key, cache in context_caches.items() if cache.expire_time <= now]:
+            context_caches.pop(key, None)
+            context_cache_locks.pop(key, None)
+        for key in [key for key, failed_date in context_cache_failures.items() if now - failed_date >= CONTEXT_CACHE_RETRY]:
+            context_cache_failures.pop(key, None)
+
+PARSE_CACHE_DIR = os.getenv('PARSE_CACHE_DIR', 'parse_cache')
+PARSE_SETTINGS = {"result_type": "text"}
+
+# path -> (mtime_ns, size, sha256) so unchanged files are not re-hashed every turn
+parse_hash_index = {}
+
+def file_sha256_cached(path):
+    stat = os.stat(path)
+    entry = parse_hash_index.get(path)
+    if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+        return entry[2]
+
+    sha256 = file_sha256(path)
+    parse_hash_index[path] = (stat.st_mtime_ns, stat.st_size, sha256)
+    return sha256
+
+def parse_cache_key(filepath):
+    """ Cache key covering both the file contents and the parser settings """
+    settings = json.dumps(PARSE_SETTINGS, sort_keys=True)
+    return hashlib.sha256((file_sha256_cached(filepath) + settings).encode('utf-8')).hexdigest()
+
+def read_parse_cache(key):
+    index_path = os.path.join(PARSE_CACHE_DIR, key + '.json')
+    text_path = os.path.join(PARSE_CACHE_DIR, key + '.txt')
+    if not os.path.exists(index_path):
+        return None
 
-    file_extractor = {".pdf": parser}
-    documents = SimpleDirectoryReader(input_files=[filepath], file_extractor=file_extractor).load_data()
-    for document in documents:
-        simplified_text = document.text
-        print(simplified_text)
-    print(documents)
-    return simplified_text
+    with open(index_path, 'r') as f:
+        offsets = json.load(f)
+    if os.path.getsize(text_path) == 0:
+        return ['' for _ in offsets]
+
+    with open(text_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return [mapped[start:end].decode('utf-8') for start, end in offsets]
+
+@contextmanager
+def replacing(path, mode='wb'):
+    """ Write to a temp file unique to this writer in PARSE_CACHE_DIR, then move it over path """
+    fd, temp_path = tempfile.mkstemp(dir=PARSE_CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def write_parse_cache(key, texts):
+    """ Store every parsed document in one text file plus an index of byte offsets """
+    os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+    index_path = os.path.join(PARSE_CACHE_DIR, key + '.json')
+    text_path = os.path.join(PARSE_CACHE_DIR, key + '.txt')
+
+    offsets = []
+    position = 0
+    with replacing(text_path) as f:
+        for text in texts:
+            data = text.encode('utf-8')
+            f.write(data)
+            offsets.append([position, position + len(data)])
+            position += len(data)
+
+    # The index is written last, so its presence marks a complete cache entry
+    with replacing(index_path, 'w') as f:
+        json.dump(offsets, f)
+
+def parseFileDocuments(filepath):
+    """ Return the text of every document LlamaParse extracts, cached on disk """
+    key = parse_cache_key(filepath)
+    texts = read_parse_cache(key)
+    if texts is not None:
+        log_event(log, 'parse cache hit', logging.DEBUG, path=filepath)
+        return texts
+
+    with span('parse'):
+        # set up parser
+        parser = llama_parse.LlamaParse(**PARSE_SETTINGS)
+
+        file_extractor = {".pdf": parser}
+        documents = llama_index_core.SimpleDirectoryReader(input_files=[filepath], file_extractor=file_extractor).load_data()
+    texts = [document.text for document in documents]
+    log_event(log, 'file parsed', path=filepath, documents=len(texts))
+
+    write_parse_cache(key, texts)
+    return texts
+
+RAG_EMBED_MODEL = LOCAL_EMBED_MODEL
+RAG_CHUNK_SIZE = 1000
+RAG_CHUNK_OVERLAP = 200
+RAG_TOP_K = 5
+# Chunks per /api/embed call, so a large document is not one huge request
+RAG_EMBED_BATCH = 64
+
+def chunk_documents(texts, size=RAG_CHUNK_SIZE, overlap=RAG_CHUNK_OVERLAP):
+    """ Split every document into overlapping character windows """
+    chunks = []
+    for text in texts:
+        start = 0
+        while start < len(text):
+            chunk = text[start:start + size].strip()
+            if chunk:
+                chunks.append(chunk)
+            if start + size >= len(text):
+                break
+            start += size - overlap
+    return chunks
+
+@telemetry.traced('embed')
+def embed_texts(texts):
+    """ Embed texts with the local Ollama embedding model, returning unit-length rows """
+    vectors = np.asarray([
+        vector
+        for start in range(0, len(texts), RAG_EMBED_BATCH)
+        for vector in local_model_client.embed(texts[start:start + RAG_EMBED_BATCH])
+    ], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def load_chunk_embeddings(filepath, chunks):
+    """ Embedding matrix for the file's chunks, computed once and memory-mapped afterwards """
+    settings = json.dumps([RAG_EMBED_MODEL, RAG_CHUNK_SIZE, RAG_CHUNK_OVERLAP])
+    key = hashlib.sha256((parse_cache_key(filepath) + settings).encode('utf-8')).hexdigest()
+    embeddings_path = os.path.join(PARSE_CACHE_DIR, key + '.npy')
+
+    if os.path.exists(embeddings_path):
+        return np.load(embeddings_path, mmap_mode='r')
+
+    embeddings = embed_texts(chunks)
+    os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+    with replacing(embeddings_path) as f:
+        np.save(f, embeddings)
+    return embeddings
+
+@telemetry.traced('retrieve')
+def retrieve_context(filepath, question, top_k=RAG_TOP_K):
+    """ Return only the passages of the file most relevant to the question """
+    chunks = chunk_documents(parseFileDocuments(filepath))
+    if len(chunks) <= top_k:
+        return '\n\n'.join(chunks)
+
+    try:
+        embeddings = load_chunk_embeddings(filepath, chunks)
+        query = embed_texts([question])[0]
+    except requests.exceptions.RequestException as e:
+        log_event(log, 'embedding failed, sending the whole document', logging.WARNING, error=str(e))
+        return '\n\n'.join(chunks)
 
-def add_record_file(display_name, storage_name, state, expiry):
+    scores = embeddings @ query
+    best = np.argpartition(-scores, top_k)[:top_k]
+    # Keep the passages in document order so the prompt reads naturally
+    return '\n.....\n'.join(chunks[i] for i in sorted(best))
+
+def add_record_file(display_name, storage_name, state, expiry, sha256=None):
     """Add a record to Firestore."""
     # Generate UUID
     record_uuid = str(uuid.uuid4())
@@ -128,110 +502,158 @@ def add_record_file(display_name, storage_name, state, expiry):
         'storage_name': storage_name,
         'state': state,
         'expiry': expiry,
+        'sha256': sha256,
         'uuid': record_uuid,
         'is_expired': False
     })
 
     return record_uuid
 
-def get_record_by_name(display_name):
-    db = firestore.client()
+def get_record_by_hash(sha256):
+    """ Get the non-expired upload records for the given file contents """
     records = db.collection('files')\
-                .where('display_name', '==', display_name).stream()
-    
-    valid_records = [record.to_dict() for record in records if not record.to_dict().get('is_expired', False)]
-    print ('\n\n\n\n\nvalid records: \n\n\n\n', valid_records, '\n\n\n\n\n')
+                .where('sha256', '==', sha256).stream()
+
+    valid_records = []
+    for record in records:
+        record = record.to_dict()
+        if not record.get('is_expired', False) and is_file_usable(record.get('expiry')):
+            valid_records.append(record)
     return valid_records
 
-def file_mark_expired(display_name):
-    db = firestore.client()
+def file_mark_expired_by_hash(sha256):
     records = db.collection('files')\
-                .where('display_name', '==', display_name).stream()
+                .where('sha256', '==', sha256).stream()
 
     for record in records:
         record_id = record.id
         db.collection('files').document(record_id).update({'is_expired': True})
-        print(f"Record {record_id} marked as expired.")
+        log_event(log, 'file record marked as expired', record_id=record_id)
 
-def add_record_chat(conv_id, message, filename, display_filename, file_path):
+def add_record_chat(conv_id, message, attachments):
     """Add a record to Firestore."""
     # Generate UUID
     record_uuid = str(uuid.uuid4())
 
-    doc_ref = db.collection('chat_history').document(record_uuid)
-    doc_ref.set({
+    chat_repository.create(dict({
         'conv_id': conv_id,
         'message': message,
-        'attached_file': filename,
-        'attached_file_path': file_path,
-        'attached_file_display': display_filename,
         'created_date': datetime.now(timezone.utc),
         'uuid': record_uuid,
         'is_deleted': False
-    })
+    }, **attachment_fields(attachments)))
+    invalidate_chat_list()
 
     return record_uuid
 
-def get_chats():
-    """ Get chats from firestore """
-    print ("\n\n\n\n 1 \n\n\n\n\n")
+CHAT_LIST_PAGE_SIZE = 30
+CHAT_LIST_CACHE_TTL = 10
+CHAT_LIST_FIELDS = ['conv_id', 'message', 'attached_file_display', 'attachments', 'created_date']
+
+# First sidebar page, the one every page load asks for
+chat_list_cache = {'expires': 0, 'page': None}
+chat_list_cache_lock = threading.Lock()
+
+def valid_chat_cursor(cursor):
+    """ Whether cursor is absent or a created_date handed out as a next_cursor """
+    if cursor is None:
+        return True
+    try:
+        datetime.fromisoformat(cursor)
+    except ValueError:
+        return False
+    return True
+
+def merge_pending_chats(chat_records, before=None):
+    """ The page with the writes the repository has not committed yet: changed chats
+    take their cached fields, and new chats created before the cursor are added """
+    pending = chat_repository.pending_records(CHAT_LIST_FIELDS + ['is_deleted'])
+    if not pending:
+        return chat_records
+
+    merged = []
+    for chat in chat_records:
+        record, _ = pending.pop(chat.get('conv_id'), (chat, False))
+        merged.append(record)
+    merged.extend(
+        record for record, created in pending.values()
+        if created and (before is None or (record.get('created_date') and record['created_date'] < before))
+    )
+    merged = [
+        {field: chat.get(field) for field in CHAT_LIST_FIELDS}
+        for chat in merged if not chat.get('is_deleted')
+    ]
+    merged.sort(key=lambda chat: chat.get('created_date') or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
+    return merged
+
+def get_chats(limit=CHAT_LIST_PAGE_SIZE, cursor=None):
+    """ Get a page of chats from firestore, newest first, with only the sidebar fields """
+    if cursor is None:
+        with chat_list_cache_lock:
+            if chat_list_cache['page'] is not None and chat_list_cache['expires'] > time.monotonic():
+                return chat_list_cache['page']
 
     chat_ref = db.collection('chat_history') \
              .where('is_deleted', '==', False) \
-             .order_by('created_date', direction='DESCENDING')
+             .order_by('created_date', direction='DESCENDING') \
+             .select(CHAT_LIST_FIELDS)
+    before = datetime.fromisoformat(cursor) if cursor is not None else None
+    if before is not None:
+        chat_ref = chat_ref.start_after({'created_date': before})
     
-    chats = chat_ref.get()
-    chat_records = [chat.to_dict() for chat in chats]
-
-    return chat_records
+    with span('firestore_read'):
+        chats = chat_ref.limit(limit).get()
+    chat_records = merge_pending_chats([chat.to_dict() for chat in chats], before)
+    has_more = len(chats) == limit or len(chat_records) > limit
+    chat_records = chat_records[:limit]
+
+    next_cursor = None
+    if has_more and chat_records and chat_records[-1].get('created_date'):
+        next_cursor = chat_records[-1]['created_date'].isoformat()
+
+    page = (chat_records, next_cursor)
+    if cursor is None:
+        with chat_list_cache_lock:
+            chat_list_cache['page'] = page
+            chat_list_cache['expires'] = time.monotonic() + CHAT_LIST_CACHE_TTL
+    return page
+
+def invalidate_chat_list():
+    with chat_list_cache_lock:
+        chat_list_cache['page'] = None
 
 def get_chat_by_conv_id(conv_id):
     """ Get a chat by conversation ID from Firestore """
-    chat_ref = db.collection('chat_history').where('conv_id', '==', conv_id).limit(1)
-    chat = chat_ref.get()
-
-    return chat[0].to_dict() if chat else None
-
-def update_chat_history(conv_id, user_ques, model_resp, conversation_context, storage_name):
-    chat_rec = get_chat_by_conv_id(conv_id)
-
-    if chat_rec:
-        if 'content' in chat_rec and isinstance(chat_rec['content'], list) and chat_rec['content']:
-            chat_rec['content'].append({
-                "role": "user",
-                "text": user_ques
-            })
-            chat_rec['content'].append({
-                "role": "model",
-                "text": model_resp
-            })
-            
-            db.collection('chat_history').document(chat_rec['uuid']).update({
-                'content': chat_rec['content'],
-                'conversation_context': conversation_context,
-                'attached_file' : storage_name
-            })
-        else:
-            content = [
-                {
-                    "role": "user",
-                    "text": user_ques
-                },
-                {
-                    "role": "model",
-                    "text": model_resp
-                }
-            ]
-            db.collection('chat_history').document(chat_rec['uuid']).update({
-                'content': content,
-                'conversation_context': conversation_context,
-                'attached_file' : storage_name
-            })
+    with span('firestore_read'):
+        return chat_repository.get(conv_id)
+
+@telemetry.traced('persist')
+def update_chat_history(conv_id, user_ques, model_resp, attachments):
+    """ Returns False when the chat does not exist """
+    # Each turn carries its timestamp so identical turns are not merged by ArrayUnion
+    created_date = datetime.now(timezone.utc)
+    return chat_repository.append_turn(conv_id, [
+        {
+            "role": "user",
+            "text": user_ques,
+            "created_date": created_date
+        },
+        {
+            "role": "model",
+            "text": model_resp,
+            "created_date": created_date
+        }
+    ], attachment_fields(attachments))
 
 
 
 
 
+def migrate_chat_history_to_turns():
+    """ Move every chat's content array into chat_history/{uuid}/turns documents """
+    migrated = chat_repository.migrate_to_turns()
+    log_event(log, 'chats migrated to turn documents', migrated=migrated)
+
 def set_missing_created_dates():
     chat_ref = db.collection('chat_history')
     chats = chat_ref.get()
@@ -243,205 +665,705 @@ def set_missing_created_dates():
 
     for chat in chats:
         if 'is_deleted' not in chat.to_dict():
-            print (chat.id)
+            log_event(log, 'setting is_deleted', chat_id=chat.id)
             chat_ref.document(chat.id).update({'is_deleted': False})
 
 
 
 
 
-app = Flask(__name__)
-model = start()
-cred = credentials.Certificate('/home/saqib/Desktop/firebase_credentials.json')
-firebase_admin.initialize_app(cred)
+FIREBASE_CREDENTIALS = os.getenv('FIREBASE_CREDENTIALS', '/home/saqib/Desktop/firebase_credentials.json')
 
-# Initialize Firestore
-db = firestore.client()
+def init_firebase():
+    cred = credentials.Certificate(FIREBASE_CREDENTIALS)
+    return firebase_admin.initialize_app(cred)
 
+def init_firestore():
+    firebase_app.instance()
+    return firestore.client()
 
+def start_local_model():
+    try:
+        if os.getenv('LLM_LOCAL_KEEP_ALIVE_INTERVAL', '300') != '0':
+            local_model_client.start_keep_alive(int(os.getenv('LLM_LOCAL_KEEP_ALIVE_INTERVAL', '300')))
+        else:
+            local_model_client.warm_up_in_background()
+    except Exception as e:
+        log_event(log, 'local model unavailable', logging.WARNING, error=str(e))
+
+# Clients are built once, on first use or by preload()
+model = LazySingleton('gemini-flash-8b', start)
+pro_model = LazySingleton('gemini-pro', lambda: start("gemini-1.5-pro-latest"))
+firebase_app = LazySingleton('firebase', init_firebase)
+db = LazySingleton('firestore', init_firestore)
+chat_repository = LazySingleton('chat repository', lambda: ChatHistoryRepository(db.instance(), schema=os.getenv('CHAT_SCHEMA', 'embedded')))
+# Enough to answer chats; the others are only used for hedging, failover and the local model
+SERVING_CLIENTS = [firebase_app, db, chat_repository, model]
+CLIENTS = SERVING_CLIENTS + [pro_model, local_model_client]
+# The background build started by /ready, if any
+ready_preload = {'thread': None}
+ready_preload_lock = threading.Lock()
+
+bp = Blueprint('chatbot', __name__)
+
+
+
+
+
+@bp.before_app_request
+def start_request_trace():
+    telemetry.start_trace(request.endpoint or 'unmatched', method=request.method, path=request.path)
+
+@bp.after_app_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@bp.teardown_app_request
+def end_request_trace(error=None):
+    # Streamed responses are torn down once their body has been sent
+    status = 500 if error is not None else getattr(g, 'response_status', 500)
+    duration = telemetry.end_trace(status=status)
+    if duration is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        telemetry.request_seconds.observe(duration, method=request.method, route=route, status=status)
+
+@bp.route('/ready', methods=['GET'])
+def ready():
+    """ 200 once the clients needed to answer chats are initialized, 503 until then.
+    Clients not built yet are started in the background; all are listed with their status. """
+    if not all(client.ready for client in CLIENTS):
+        with ready_preload_lock:
+            if ready_preload['thread'] is None or not ready_preload['thread'].is_alive():
+                ready_preload['thread'] = preload([client for client in CLIENTS if not client.ready])
+    status = readiness(CLIENTS)
+    return jsonify(status), 200 if all(client.ready for client in SERVING_CLIENTS) else 503
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(telemetry.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/')
+def home():
+    # set_missing_created_dates()
+    # migrate_chat_history_to_turns()
+    chat_history, next_cursor = get_chats()
+    return render_template('mybot.html',  chat_history=chat_history, next_cursor=next_cursor)
 
 
+@bp.route('/list_chats', methods=['GET'])
+def list_chats():
+    cursor = request.args.get('cursor')
+    if not valid_chat_cursor(cursor):
+        return jsonify({"error": "Invalid cursor"}), 400
 
-@app.route('/')
-def home():
-    start()
-    # set_missing_created_dates()
-    chat_history = get_chats()
-    return render_template('mybot.html',  chat_history=chat_history)
+    chat_history, next_cursor = get_chats(cursor=cursor)
+    chats = [{
+        'conv_id': chat.get('conv_id'),
+        'message': chat.get('message'),
+        'attached_file_display': chat.get('attached_file_display'),
+        'attachments': attachment_display_names(chat),
+    } for chat in chat_history]
+    return jsonify({"chats": chats, "next_cursor": next_cursor})
 
 
 
-@app.route('/get_chat_content/<conv_id>', methods=['GET'])
+@bp.route('/get_chat_content/<conv_id>', methods=['GET'])
 def get_chat(conv_id):
-    print ('\n\n\n in get chat \n\n\conv id: n', conv_id)
     chat_record = get_chat_by_conv_id(conv_id) 
-    print ('\n\n\nchat record\n', chat_record)
+    log_event(log, 'chat loaded', logging.DEBUG, conv_id=conv_id, found=chat_record is not None)
 
     
     if chat_record:
+        # Turns are returned a page at a time when a limit is given, latest page first
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        if not valid_turn_cursor(chat_record, cursor):
+            return jsonify({"error": "Invalid cursor"}), 400
+        content, next_cursor = chat_repository.load_turns(conv_id, limit, cursor)
+        chat_record['content'] = content
+        chat_record['next_cursor'] = next_cursor
+        chat_record.pop('conversation_context', None)
         return jsonify(chat_record)
     return jsonify({"error": "Chat not found"}), 404
 
 
 
 
-def get_response_local(user_message, file_path):
-    load_dotenv()
-    url = os.getenv("LLM_LOCAL")
-    url = url+'/api/generate'
-    file_pretext = 'Considering the follwing as raw text extracted from a PDF document, '
-
+def local_prompt(user_message, file_paths, history=None):
+    """ The prompt for the local model: the passages of the files relevant to the message,
+    then history (the conversation ending with the message) or the message alone """
+    prompt = history or user_message
+    file_paths = [file_path for file_path in file_paths or [] if file_path]
+    if not file_paths:
+        return prompt
 
-    if file_path and file_path != '':
-        print ('\n processing file... \n\n')
-        file_content = parseFile(file_path)
-        print (file_content)
-        user_message = file_pretext+file_content+'.....' + user_message
-        print ('\n\n file processed ...\n')
-    
-    data = {
-        "model": "llama3.2:1b",
-        "prompt": user_message
+    if len(file_paths) == 1:
+        file_pretext = 'Considering the follwing as raw text passages extracted from a PDF document, '
+        file_content = retrieve_context(file_paths[0], user_message)
+    else:
+        # The files share the passage budget, but each gets at least one passage, so past
+        # RAG_TOP_K files the prompt grows by one passage per file
+        file_pretext = 'Considering the follwing as raw text passages extracted from PDF documents, '
+        top_k = max(1, RAG_TOP_K // len(file_paths))
+        file_content = '\n\n'.join(
+            f"From {os.path.basename(file_path)}:\n" + retrieve_context(file_path, user_message, top_k)
+            for file_path in file_paths
+        )
+    log_event(log, 'file passages retrieved', logging.DEBUG, paths=file_paths, characters=len(file_content))
+    return file_pretext+file_content+'.....' + prompt
+
+def stream_local_model(prompt):
+    with span('generate', backend='local'):
+        for data in local_model_client.generate_stream(prompt):
+            if data.get("response"):
+                yield data["response"]
+
+def stream_response_gemini(model_response):
+    """ Yield text chunks from a generate_content(..., stream=True) response """
+    for chunk in model_response:
+        if chunk.candidates and chunk.candidates[0].content.parts:
+            yield chunk.candidates[0].content.parts[0].text
+
+def gemini_backend(name, gemini_model, cost):
+    def model_and_contents(llm_request):
+        uploaded_files = llm_request.get('gemini_files')
+        if not uploaded_files:
+            return gemini_model, llm_request['contents']
+        cached_model = get_context_cached_model(gemini_model, uploaded_files)
+        if cached_model is not None:
+            return cached_model, llm_request['contents']
+        return gemini_model, list(uploaded_files) + llm_request['contents']
+
+    def generate(llm_request):
+        request_model, contents = model_and_contents(llm_request)
+        with span('generate', backend=name):
+            model_response = request_model.generate_content(contents, request_options=llm_request['request_options'])
+        return model_response.candidates[0].content.parts[0].text
+
+    def stream(llm_request):
+        request_model, contents = model_and_contents(llm_request)
+        with span('generate', backend=name):
+            model_response = request_model.generate_content(contents, stream=True, request_options=llm_request['request_options'])
+            yield from stream_response_gemini(model_response)
+
+    return LLMBackend(name, generate, stream, cost=cost, can_serve=lambda llm_request: llm_request.get('contents') is not None)
+
+def local_backend(cost):
+    def generate(llm_request):
+        return ''.join(stream(llm_request))
+
+    def stream(llm_request):
+        yield from stream_local_model(local_prompt(llm_request['question'], llm_request['file_paths'], llm_request['prompt']))
+
+    def can_serve(llm_request):
+        # The local model reads the files from disk, it cannot use files only uploaded to Gemini
+        return local_model_configured() \
+            and all(file_path and os.path.exists(file_path) for file_path in llm_request['file_paths'])
+
+    return LLMBackend('local', generate, stream, cost=cost, can_serve=can_serve)
+
+def llm_request(contents=None, prompt=None, file_paths=None, request_options=None, gemini_files=None, question=None):
+    """ What the router hands to a backend: contents and the uploaded files for Gemini,
+    a prompt and the files' paths for the local model (None for a file it has no copy of).
+    question, the latest message alone, is what the files' passages are retrieved for. """
+    return {
+        'contents': contents,
+        'gemini_files': gemini_files or [],
+        'prompt': prompt,
+        'question': question or prompt,
+        'file_paths': file_paths or [],
+        'request_options': request_options or {},
     }
 
-    try:
-        print ('\n\n\nawaiting response from local model....\n\n')
-        response = requests.post(url, json=data, stream=True)  
-        response.raise_for_status() 
-
-        full_text = ''
-        for chunk in response.iter_lines():
-            if chunk:
-                data = json.loads(chunk.decode('utf-8'))
-                full_text += data.get("response", "")
-                if data.get("done"):
-                    break
-        print(full_text)
-
-        return full_text
-
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred: {e}")
-
-
-
-
-
+def response_cache_file_key(attachments):
+    """ Per attached file, its content hash when it is on disk, its Gemini name otherwise """
+    keys = sorted(
+        file_sha256_cached(attachment['path']) if attachment['path'] and os.path.exists(attachment['path'])
+        else attachment['storage_name']
+        for attachment in attachments
+    )
+    if len(keys) <= 1:
+        return keys[0] if keys else None
+    return hashlib.sha256(json.dumps(keys).encode('utf-8')).hexdigest()
+
+def sse_event(payload):
+    """ Format a payload as a single server-sent event """
+    return f"data: {json.dumps(payload)}\n\n"
+
+def sse_error(error, **fields):
+    """ The last event of a stream that failed after its headers were sent """
+    log_event(log, 'streaming the answer failed', logging.ERROR, error=str(error))
+    return sse_event(dict(fields, error='The model could not answer, please try again.', done=True))
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
-conversation_context = {}
-@app.route('/chat', methods=['POST'])
+def save_chat_turn(conversation_id, user_message, response, attachments):
+    """ Append the turn to the conversation context and persist it to Firestore """
+    context_store.append(conversation_id, user_message, response)
+    
+    user_ques = {
+        "role": "user",
+        "text": user_message
+    }
+    
+    model_resp = {
+        "role": "model",
+        "text": response
+    }
+    if not update_chat_history(conversation_id, user_ques, model_resp, attachments):
+        log_event(log, 'chat turn not saved, conversation not found', logging.ERROR, conversation_id=conversation_id)
+        return False
+    return True
+
+def load_conversation_context(conv_id):
+    """ History, summary and number of summarized messages of a stored conversation """
+    chat_conv = get_chat_by_conv_id(conv_id)
+    if chat_conv is None:
+        return [], None, 0
+
+    # The history is rebuilt from the stored turns; chats written before that was the
+    # case may only have it in conversation_context
+    history = chat_repository.get_history(conv_id)
+    if not history and chat_conv.get('schema') != SCHEMA_TURNS:
+        history = (chat_conv.get('conversation_context') or {}).get(conv_id) or []
+    return history, chat_conv.get('context_summary'), chat_conv.get('context_summarized', 0)
+
+def save_conversation_summary(conv_id, summary, summarized):
+    chat_repository.update_fields(conv_id, {'context_summary': summary, 'context_summarized': summarized})
+
+def summarize_conversation(summary, messages):
+    """ Fold older messages into the running summary of a conversation """
+    prompt = [
+        "Summarize the following conversation in a few sentences. Keep every fact, name and decision needed to answer follow-up questions.",
+    ]
+    if summary:
+        prompt.append(f"Summary so far: {summary}")
+    prompt.extend(messages)
+
+    summary_response = model.generate_content(prompt, request_options={"timeout": 60})
+    return summary_response.candidates[0].content.parts[0].text
+
+
+
+
+
+
+# Seconds to wait for a backend before hedging with the next one; answers about
+# an attached file are given longer
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', 30))
+LLM_FILE_DEADLINE = float(os.getenv('LLM_FILE_DEADLINE', 120))
+llm_router = LLMRouter(
+    [
+        gemini_backend('gemini-flash-8b', model, cost=float(os.getenv('LLM_FLASH_COST', 1))),
+        local_backend(cost=float(os.getenv('LLM_LOCAL_COST', 2))),
+        gemini_backend('gemini-pro', pro_model, cost=float(os.getenv('LLM_PRO_COST', 17))),
+    ],
+    policy=os.getenv('LLM_ROUTING_POLICY', 'cheapest'),
+    deadline=LLM_DEADLINE,
+    # 0 runs every backend call on its own thread
+    max_workers=int(os.getenv('LLM_ROUTER_WORKERS', 0)) or None
+)
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 1024)),
+    ttl=int(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+    similarity_threshold=float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.95)),
+    # The semantic tier embeds every question with the local embedding model
+    embed=embed_texts if os.getenv('RESPONSE_CACHE_SEMANTIC') == '1' else None
+)
+
+telemetry.register(telemetry.Gauge(
+    'chatbot_llm_backend_latency_seconds', 'Rolling latency of each LLM backend', ('backend', 'quantile'),
+    lambda: {(name, quantile): stats['p' + quantile] for name, stats in llm_router.snapshot()['backends'].items() for quantile in ('50', '95')}
+))
+telemetry.register(telemetry.Gauge(
+    'chatbot_llm_backend_error_rate', 'Rolling error rate of each LLM backend', ('backend',),
+    lambda: {name: stats['error_rate'] for name, stats in llm_router.snapshot()['backends'].items()}
+))
+telemetry.register(telemetry.Gauge(
+    'chatbot_response_cache_total', 'Response cache lookups by result', ('result',),
+    lambda: {result: response_cache.stats()[result] for result in ('hits', 'semantic_hits', 'misses')},
+    metric_type='counter'
+))
+telemetry.register(telemetry.Gauge(
+    'chatbot_file_watcher_pending', 'Uploaded files waiting to become ACTIVE', (),
+    lambda: {(): file_watcher.stats()['pending']}
+))
+telemetry.register(telemetry.Gauge(
+    'chatbot_file_watcher_total', 'File state polls and the files that failed or timed out', ('result',),
+    lambda: {result: file_watcher.stats()[result] for result in ('polls', 'failures', 'timeouts')},
+    metric_type='counter'
+))
+telemetry.register(telemetry.Gauge(
+    'chatbot_local_model_cold_starts_total', 'Local model requests that had to load the model', (),
+    lambda: {(): local_model_client.stats.snapshot()['cold_starts'] if local_model_client.ready else None},
+    metric_type='counter'
+))
+
+context_store = ConversationContextStore(
+    load_conversation_context,
+    token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 8000)),
+    summarizer=summarize_conversation if os.getenv('CONTEXT_SUMMARIZE') == '1' else None,
+    save_summary=save_conversation_summary
+)
+
+@bp.route('/chat', methods=['POST'])
 def chat():
-    global conversation_context
     user_message = request.json.get('message')
-    input_file_path = request.json.get('path')
     conversation_id = request.json.get('conversation_id')
     use_local_model = request.json.get('use_local_model')
+    stream = request.json.get('stream', False)
+    requested_attachments = request_attachments(request.json)
     is_new_conversation = False
-    storage_name = None
-    print ('\n\n\n conv id \n\n\n\n', conversation_id)
+    attachments = []
+    log_event(log, 'chat request', logging.DEBUG, conversation_id=conversation_id, stream=stream, use_local_model=use_local_model)
 
     if use_local_model == 'local':
-        response = get_response_local(user_message, input_file_path)
-        return jsonify({"response": response})
+        # Answered without a stored conversation; Gemini can step in for plain messages
+        local_request = llm_request(
+            contents=None if requested_attachments else [user_message],
+            prompt=user_message,
+            file_paths=[attachment['path'] for attachment in requested_attachments]
+        )
+        if stream:
+            def generate_local():
+                backend_used = []
+                try:
+                    for text in llm_router.stream(local_request, preferred='local', on_backend=backend_used.append):
+                        yield sse_event({"token": text})
+                except Exception as e:
+                    yield sse_error(e)
+                    return
+                yield sse_event({"done": True, "backend": backend_used[0] if backend_used else None})
+            return sse_response(generate_local())
+
+        response, backend = llm_router.generate(local_request, preferred='local')
+        return jsonify({"response": response, "backend": backend})
 
     if user_message is None:
         return jsonify({"response": "No message received"}), 400
-    user_ques = {
-        "role": "user",
-        "text": user_message
-    }
 
     if conversation_id is None or conversation_id == '':
-        print ('\n\n\n new conv \n\n\n\n')
         conversation_id = str(uuid4())  
-        conversation_context[conversation_id] = []
+        log_event(log, 'new conversation', logging.DEBUG, conversation_id=conversation_id)
+        context_store.create(conversation_id)
         is_new_conversation = True
     else:
         chat_conv = get_chat_by_conv_id(conversation_id)
-        conversation_context = chat_conv['conversation_context'] if 'conversation_context' in chat_conv else None
-        storage_name = chat_conv['attached_file'] if 'attached_file' in chat_conv else None
-        print ('\n\n\n\n\n  storage_name got \n\n\n\n\n\n', storage_name, '\n\n\n\n\n\n\n\n')
-
-    if conversation_context is None:
-        conversation_context = {} 
-
-    conversation_history = conversation_context.get(conversation_id, []) if conversation_context else []
-    conversation_history.append(user_message)
-
-    print ('\n\n\n\n\n  input_file_path got \n\n\n\n\n\n', input_file_path, '\n\n\n\n\n\n\n\n')
-
-    if ( (input_file_path and input_file_path != '' and input_file_path != None) or (storage_name and storage_name != '' and storage_name != None)):
-        input_file_name = request.json.get('filename')
-
-        file_processed = processFile(input_file_name, input_file_path, storage_name)
-        # print ('\n\n\n\n file_processed sent \n\n\n\n', file_processed, '\n\n\n\n\n')
-        storage_name = file_processed.name
-        model_response = model.generate_content(
-            [file_processed] + conversation_history,
-            request_options={"timeout": 600}
-        )
-
-        if is_new_conversation:
-            add_record_chat(conversation_id, user_message, file_processed.name, file_processed.display_name, input_file_path)
+        if chat_conv is None:
+            return jsonify({"response": "Conversation not found"}), 404
+        attachments = conversation_attachments(chat_conv)
+
+    # Only the most recent turns that fit the token budget are sent to the model
+    conversation_history = context_store.window(conversation_id, user_message)
+
+    attachments = merge_attachments(attachments, requested_attachments)
+    log_event(log, 'chat attachments', logging.DEBUG, attachments=len(attachments))
+
+    if attachments:
+        # Every file is uploaded or looked up at once; the turn goes ahead with the ready ones
+        files_processed = resolve_attachments(attachments)
+        # The Gemini backends add the files, or read them from their context cache
+        contents = conversation_history
+        request_options = {"timeout": 600}
     else:
-        model_response = model.generate_content(
-            conversation_history,
-            request_options={}
-        )
+        files_processed = []
+        contents = conversation_history
+        request_options = {}
+
+    if is_new_conversation:
+        add_record_chat(conversation_id, user_message, attachments)
+
+    ready_attachments = [attachment for attachment in attachments if attachment['status'] == 'ready']
+    # The local model gets the same windowed history as plain text
+    chat_request = llm_request(
+        contents=contents,
+        prompt='\n\n'.join(conversation_history),
+        question=user_message,
+        file_paths=[attachment['path'] for attachment in ready_attachments],
+        request_options=request_options,
+        gemini_files=files_processed
+    )
+    deadline = LLM_FILE_DEADLINE if files_processed else LLM_DEADLINE
+    attachment_status = attachment_statuses(attachments)
+
+    # Answers are reused for the same question on the same files after the same turns
+    cache_file_key = response_cache_file_key(ready_attachments)
+    cache_context = conversation_history[:-1]
+    cached, cache_vector = response_cache.get(
+        [backend.name for backend in llm_router.candidates(chat_request, conversation_id)],
+        cache_file_key, user_message, cache_context
+    )
+    if cached is not None:
+        response, backend = cached
+        log_event(log, 'response cache hit', logging.DEBUG, conversation_id=conversation_id, backend=backend)
+        save_chat_turn(conversation_id, user_message, response, attachments)
+        if stream:
+            def generate_cached():
+                yield sse_event({"token": response})
+                yield sse_event({"done": True, "conversation_id": conversation_id, "backend": backend, "cached": True, "attachments": attachment_status})
+            return sse_response(generate_cached())
+        return jsonify({"response": response, "conversation_id": conversation_id, "backend": backend, "cached": True, "attachments": attachment_status})
+
+    if stream:
+        def generate():
+            response = ''
+            backend_used = []
+            try:
+                for text in llm_router.stream(chat_request, conversation_id, deadline=deadline, on_backend=backend_used.append):
+                    response += text
+                    yield sse_event({"token": text})
+            except Exception as e:
+                yield sse_error(e, conversation_id=conversation_id)
+                return
+            # Persist only once the whole answer has been streamed to the client
+            save_chat_turn(conversation_id, user_message, response, attachments)
+            if backend_used:
+                response_cache.put(backend_used[0], cache_file_key, user_message, response, cache_context, cache_vector)
+            yield sse_event({"done": True, "conversation_id": conversation_id, "backend": backend_used[0] if backend_used else None, "attachments": attachment_status})
+        return sse_response(generate())
+
+    response, backend = llm_router.generate(chat_request, conversation_id, deadline=deadline)
+    save_chat_turn(conversation_id, user_message, response, attachments)
+    response_cache.put(backend, cache_file_key, user_message, response, cache_context, cache_vector)
+
+    return jsonify({"response": response, "conversation_id": conversation_id, "backend": backend, "attachments": attachment_status})
+
+
+
+
+
+# Uploads mostly wait on Gemini, so many can run at once
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 16))
+INGEST_TIMEOUT = 600
+INGEST_JOB_TTL = timedelta(hours=1)
+
+FILE_LOOKUP_WORKERS = int(os.getenv('FILE_LOOKUP_WORKERS', 8))
+
+# Background uploads to Gemini, started as soon as /upload has saved the file. Workers
+# only send the bytes; the file watcher resumes the job once Gemini has processed them.
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+# get_file lookups of files uploaded on an earlier turn, kept off the upload pool
+lookup_executor = ThreadPoolExecutor(max_workers=FILE_LOOKUP_WORKERS, thread_name_prefix='file-lookup')
+ingest_jobs = {}
+ingest_jobs_lock = threading.Lock()
+
+def ingest_file(job_id, file_name, file_path):
+    job = ingest_jobs[job_id]
+    job['status'] = 'processing'
+    job['started_date'] = datetime.now(timezone.utc)
+
+    uploaded = processFile(file_name, file_path, None)
+    if not isinstance(uploaded, Future):
+        uploaded_file, uploaded = uploaded, Future()
+        uploaded.set_result(uploaded_file)
+    return when_done(uploaded, finish_ingest, job_id)
+
+def finish_ingest(finished, job_id):
+    job = ingest_jobs[job_id]
+    try:
+        uploaded_file = finished.result()
+    except Exception as e:
+        log_event(log, 'ingest failed', logging.ERROR, job_id=job_id, error=str(e))
+        uploaded_file = None
 
-        if is_new_conversation:
-            add_record_chat(conversation_id, user_message, None, None, None)
-    
-    response = model_response.candidates[0].content.parts[0].text
-    conversation_history.append(response)
-    conversation_context[conversation_id] = conversation_history
-    
-    user_ques = {
-        "role": "user",
-        "text": user_message
-    }
-    
-    model_resp = {
-        "role": "model",
-        "text": response
+    job['finished_date'] = datetime.now(timezone.utc)
+    if uploaded_file is None:
+        job['status'] = 'failed'
+    else:
+        job['status'] = 'ready'
+        job['storage_name'] = uploaded_file.name
+        job['display_name'] = uploaded_file.display_name
+    return uploaded_file
+
+def start_ingest(file_name, file_path):
+    """ Queue the Gemini upload for a saved file and return its job id """
+    job_id = str(uuid4())
+    now = datetime.now(timezone.utc)
+
+    with ingest_jobs_lock:
+        # Forget jobs that finished a while ago so the registry stays small
+        for old_id in [key for key, job in ingest_jobs.items()
+                       if job.get('finished_date') and now - job['finished_date'] > INGEST_JOB_TTL]:
+            del ingest_jobs[old_id]
+
+        ingest_jobs[job_id] = {
+            'job_id': job_id,
+            'status': 'queued',
+            'file_name': file_name,
+            'file_path': file_path,
+            'created_date': now,
+        }
+        ingest_jobs[job_id]['future'] = submit_chained(ingest_executor, ingest_file, job_id, file_name, file_path)
+
+    return job_id
+
+def request_attachments(payload):
+    """ Files attached to a /chat request: its attachments list, or the single
+    path/filename/job_id older clients send. A file with required false does not
+    hold up the answer; it is used from the first turn it is ready on. """
+    attachments = payload.get('attachments')
+    if attachments is None:
+        attachments = [payload]
+    return [{
+        'path': attachment.get('path') or None,
+        'display_name': attachment.get('filename'),
+        'storage_name': None,
+        'job_id': attachment.get('job_id'),
+        'required': attachment.get('required', True),
+    } for attachment in attachments if attachment.get('path') or attachment.get('job_id')]
+
+def conversation_attachments(chat_conv):
+    """ Files attached to a stored conversation; older records only have attached_file """
+    if not chat_conv:
+        return []
+    if chat_conv.get('attachments'):
+        return [dict(attachment, job_id=attachment.get('job_id'), required=attachment.get('required', True))
+                for attachment in chat_conv['attachments']]
+    if chat_conv.get('attached_file'):
+        return [{
+            'path': chat_conv.get('attached_file_path'),
+            'display_name': chat_conv.get('attached_file_display'),
+            'storage_name': chat_conv['attached_file'],
+            'job_id': None,
+            'required': True,
+        }]
+    return []
+
+def merge_attachments(stored, requested):
+    """ The conversation's files followed by the requested ones it does not have yet """
+    known_paths = {os.path.normpath(attachment['path']) for attachment in stored if attachment['path']}
+    merged = list(stored)
+    for attachment in requested:
+        if attachment['path'] and os.path.normpath(attachment['path']) in known_paths:
+            continue
+        if attachment['path']:
+            known_paths.add(os.path.normpath(attachment['path']))
+        merged.append(attachment)
+    return merged
+
+def attachment_future(attachment):
+    """ The running upload of an attachment, a new upload on the ingest pool, or a lookup
+    of an uploaded file on the lookup pool. New uploads are ingest jobs, so a file still
+    pending next turn is not uploaded twice. """
+    job = ingest_jobs.get(attachment['job_id']) if attachment['job_id'] else None
+    if job is not None and attachment['storage_name'] is None:
+        return job['future']
+    if attachment['storage_name'] is None and attachment['path']:
+        attachment['job_id'] = start_ingest(attachment['display_name'], attachment['path'])
+        return ingest_jobs[attachment['job_id']]['future']
+    return submit_chained(lookup_executor, processFile, attachment['display_name'], attachment['path'], attachment['storage_name'])
+
+def resolve_attachments(attachments, timeout=INGEST_TIMEOUT):
+    """ Upload or look up every attachment concurrently and return the Gemini files ready
+    for this turn. Waits for the required files only; each attachment gets a status of
+    'ready', 'pending' (not ready in time, tried again next turn) or 'failed'. """
+    futures = [(attachment, attachment_future(attachment)) for attachment in attachments]
+    with span('attachments'):
+        wait([future for attachment, future in futures if attachment['required']], timeout=timeout)
+
+    uploaded_files = []
+    for attachment, future in futures:
+        attachment['status'] = 'pending'
+        if not future.done():
+            log_event(log, 'attachment not ready', logging.WARNING, display_name=attachment['display_name'], required=attachment['required'])
+            continue
+        try:
+            uploaded_file = future.result()
+        except Exception as e:
+            log_event(log, 'attachment failed', logging.ERROR, display_name=attachment['display_name'], error=str(e))
+            uploaded_file = None
+        if uploaded_file is None:
+            attachment['status'] = 'failed'
+            continue
+        attachment['status'] = 'ready'
+        attachment['storage_name'] = uploaded_file.name
+        attachment['display_name'] = attachment['display_name'] or uploaded_file.display_name
+        uploaded_files.append(uploaded_file)
+    return uploaded_files
+
+def attachment_fields(attachments):
+    """ Conversation fields for its attachments; the attached_file* fields keep the
+    first file for older readers """
+    first = attachments[0] if attachments else {}
+    return {
+        'attachments': [{
+            'storage_name': attachment.get('storage_name'),
+            'display_name': attachment.get('display_name'),
+            'path': attachment.get('path'),
+            'required': attachment.get('required', True),
+            'job_id': attachment.get('job_id') if attachment.get('status') == 'pending' else None,
+        } for attachment in attachments],
+        'attached_file': first.get('storage_name'),
+        'attached_file_path': first.get('path'),
+        'attached_file_display': first.get('display_name'),
     }
-    update_chat_history(conversation_id, user_ques, model_resp, conversation_context, storage_name)
 
-    return jsonify({"response": response, "conversation_id": conversation_id})
+def attachment_statuses(attachments):
+    return [{
+        'display_name': attachment['display_name'],
+        'storage_name': attachment['storage_name'],
+        'status': attachment.get('status', 'pending'),
+    } for attachment in attachments]
 
+def attachment_display_names(chat):
+    if chat.get('attachments'):
+        return [attachment.get('display_name') for attachment in chat['attachments']]
+    return [chat['attached_file_display']] if chat.get('attached_file_display') else []
 
+@bp.route('/llm_router_stats', methods=['GET'])
+def llm_router_stats():
+    return jsonify(llm_router.snapshot())
 
+@bp.route('/response_cache_stats', methods=['GET'])
+def response_cache_stats():
+    return jsonify(response_cache.stats())
 
+@bp.route('/local_model_stats', methods=['GET'])
+def local_model_stats():
+    return jsonify(local_model_client.stats.snapshot())
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload():
-    print ("\n upload called  \n")
     if 'file' not in request.files:
         return jsonify({"error": "No file uploaded"}), 400
-    
-    print (request.files)
 
     file = request.files['file']
     file_path = os.path.join('uploads', file.filename)
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
     file.save(file_path)
+
+    job_id = start_ingest(file.filename, file_path)
+    log_event(log, 'upload saved', file_name=file.filename, job_id=job_id)
    
-    return jsonify({"file_path": file_path,"file_name": file.filename})
+    return jsonify({"file_path": file_path,"file_name": file.filename, "job_id": job_id})
+
+@bp.route('/upload_status/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
 
-@app.route('/delete_chat/<conv_id>', methods=['POST'])
+    status = {key: value for key, value in dict(job).items() if key != 'future'}
+    start_date = job.get('started_date') or job['created_date']
+    end_date = job.get('finished_date') or datetime.now(timezone.utc)
+    status['elapsed_seconds'] = (end_date - start_date).total_seconds()
+    return jsonify(status)
+
+@bp.route('/delete_chat/<conv_id>', methods=['POST'])
 def delete_chat_by_conv_id(conv_id):
  
-    print (conv_id)
+    log_event(log, 'deleting chat', conv_id=conv_id)
 
-    # Get the chat reference
-    chat_ref = db.collection('chat_history').where('conv_id', '==', conv_id).limit(1)
-    chat = chat_ref.get()
-    
-    if chat:
-        chat_doc = chat[0]  # Get the first document
-        chat_ref = db.collection('chat_history').document(chat_doc.id)
-        chat_ref.update({'is_deleted': True})  # Set is_deleted to True
-        
+    if chat_repository.update_fields(conv_id, {'is_deleted': True}):
+        chat_repository.flush()
+        invalidate_chat_list()
         return {"message": "Chat deleted successfully"}, 200  # Success response
     else:
         return {"message": "Chat not found"}, 404  # Not found response
@@ -449,9 +1371,25 @@ def delete_chat_by_conv_id(conv_id):
 
 
 
-def run_flask_app():
-    print("Server running on http://127.0.0.1:5000/")
-    app.run(debug=True, use_reloader=False)
+def create_app(preload_clients=None):
+    """ The Flask app. Clients are built on first use; with preload_clients (or PRELOAD=1)
+    they are warmed in the background so the first requests do not pay for it. """
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(bp)
+
+    threading.Thread(target=start_local_model, name='local-model-start', daemon=True).start()
+    if preload_clients if preload_clients is not None else os.getenv('PRELOAD') == '1':
+        preload(CLIENTS)
+    return flask_app
+
+def run_flask_app(preload_clients=False):
+    log_event(log, 'server running', url="http://127.0.0.1:5000/")
+    create_app(preload_clients).run(debug=True, use_reloader=False)
 
-run_flask_app()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--preload', action='store_true', help='initialize the SDK clients in the background at startup')
+    run_flask_app(parser.parse_args().preload)
+else:
+    app = create_app()
 
@@ -0,0 +1,397 @@
+from quart import Quart, render_template, request, jsonify, Response
+import asyncio
+import logging
+import os
+import json
+import uuid
+from uuid import uuid4
+from datetime import datetime, timezone
+import httpx
+
+# The models, file processing and caches are shared with the Flask server
+import server
+from lazy import LazyModule, LazySingleton
+from chat_repository import SCHEMA_TURNS, turn_id, valid_turn_cursor
+from context_store import ConversationContextStore
+from local_llm import get_local_model_client
+import telemetry
+from telemetry import log_event
+
+log = logging.getLogger(__name__)
+
+LLM_LOCAL_TIMEOUT = httpx.Timeout(600.0, connect=10.0)
+
+app = Quart(__name__)
+model = server.model
+firestore = LazyModule('firebase_admin.firestore')
+firestore_async = LazyModule('firebase_admin.firestore_async')
+
+
+def init_firestore_async():
+    server.firebase_app.instance()
+    return firestore_async.client()
+
+
+db = LazySingleton('firestore async', init_firestore_async)
+local_client = httpx.AsyncClient(timeout=LLM_LOCAL_TIMEOUT)
+
+# History of each conversation is loaded from Firestore on first use
+context_store = ConversationContextStore(
+    lambda conv_id: ([], None, 0),
+    token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', 8000))
+)
+
+
+
+
+
+async def add_record_chat(conv_id, message, attachments):
+    """Add a record to Firestore."""
+    record_uuid = str(uuid.uuid4())
+
+    await db.collection('chat_history').document(record_uuid).set(dict({
+        'conv_id': conv_id,
+        'message': message,
+        'created_date': datetime.now(timezone.utc),
+        'uuid': record_uuid,
+        'is_deleted': False,
+        'schema': server.chat_repository.schema
+    }, **server.attachment_fields(attachments)))
+    server.invalidate_chat_list()
+
+    return record_uuid
+
+async def get_chat_by_conv_id(conv_id):
+    """ Get a chat by conversation ID from Firestore """
+    chat = await db.collection('chat_history').where('conv_id', '==', conv_id).limit(1).get()
+
+    return chat[0].to_dict() if chat else None
+
+async def get_chats(limit=server.CHAT_LIST_PAGE_SIZE, cursor=None):
+    """ Get a page of chats from firestore, newest first, with only the sidebar fields """
+    chat_ref = db.collection('chat_history') \
+             .where('is_deleted', '==', False) \
+             .order_by('created_date', direction='DESCENDING') \
+             .select(server.CHAT_LIST_FIELDS)
+    if cursor is not None:
+        chat_ref = chat_ref.start_after({'created_date': datetime.fromisoformat(cursor)})
+
+    chats = await chat_ref.limit(limit).get()
+    chat_records = [chat.to_dict() for chat in chats]
+
+    next_cursor = None
+    if len(chat_records) == limit and chat_records[-1].get('created_date'):
+        next_cursor = chat_records[-1]['created_date'].isoformat()
+    return chat_records, next_cursor
+
+async def load_turns(chat_record, limit=None, cursor=None):
+    """ A page of a chat's turns and the cursor of the page before it, for either schema """
+    if chat_record.get('schema') != SCHEMA_TURNS:
+        content = chat_record.get('content') or []
+        end = int(cursor) if cursor else len(content)
+        start = max(0, end - limit) if limit else 0
+        return content[start:end], (str(start) if start > 0 else None)
+
+    query = db.collection('chat_history').document(chat_record['uuid']).collection('turns') \
+        .order_by(firestore.FieldPath.document_id(), direction='DESCENDING')
+    if cursor:
+        query = query.start_after({firestore.FieldPath.document_id(): cursor})
+    if limit:
+        query = query.limit(limit)
+
+    docs = await query.get()
+    next_cursor = docs[-1].id if limit and len(docs) == limit else None
+    return [doc.to_dict() for doc in reversed(docs)], next_cursor
+
+async def load_conversation_context(conv_id, chat_record):
+    """ Put a stored conversation's history in the context store unless it is there already """
+    if conv_id in context_store:
+        return
+
+    turns, _ = await load_turns(chat_record)
+    history = [turn['text'].get('text') if isinstance(turn.get('text'), dict) else turn.get('text') for turn in turns]
+    if not history and chat_record.get('schema') != SCHEMA_TURNS:
+        history = (chat_record.get('conversation_context') or {}).get(conv_id) or []
+    context_store.create(conv_id, history, chat_record.get('context_summary'), chat_record.get('context_summarized', 0))
+
+async def update_chat_history(conv_id, user_ques, model_resp, attachments):
+    """ Returns False when the chat does not exist """
+    chat_rec = await get_chat_by_conv_id(conv_id)
+    if not chat_rec:
+        return False
+
+    created_date = datetime.now(timezone.utc)
+    turns = [
+        {"role": "user", "text": user_ques, "created_date": created_date},
+        {"role": "model", "text": model_resp, "created_date": created_date}
+    ]
+    doc_ref = db.collection('chat_history').document(chat_rec['uuid'])
+
+    if chat_rec.get('schema') == SCHEMA_TURNS:
+        batch = db.batch()
+        turn_count = chat_rec.get('turn_count', 0)
+        for position, turn in enumerate(turns, start=turn_count):
+            batch.set(doc_ref.collection('turns').document(turn_id(created_date, position)), turn)
+        batch.update(doc_ref, dict({
+            'turn_count': firestore.Increment(len(turns))
+        }, **server.attachment_fields(attachments)))
+        await batch.commit()
+    else:
+        await doc_ref.update(dict({
+            'content': firestore.ArrayUnion(turns)
+        }, **server.attachment_fields(attachments)))
+    return True
+
+async def save_chat_turn(conversation_id, user_message, response, attachments):
+    """ Append the turn to the conversation context and persist it to Firestore """
+    context_store.append(conversation_id, user_message, response)
+
+    user_ques = {
+        "role": "user",
+        "text": user_message
+    }
+
+    model_resp = {
+        "role": "model",
+        "text": response
+    }
+    if not await update_chat_history(conversation_id, user_ques, model_resp, attachments):
+        log_event(log, 'chat turn not saved, conversation not found', logging.ERROR, conversation_id=conversation_id)
+        return False
+    return True
+
+
+
+
+
+async def stream_response_local(user_message, file_paths):
+    """ Yield text chunks from the local model as soon as Ollama sends them """
+    local_model = get_local_model_client()
+    url = local_model.url('/api/generate')
+
+    if file_paths:
+        # Parsing and retrieval are blocking, keep them off the event loop
+        user_message = await asyncio.to_thread(server.local_prompt, user_message, file_paths)
+
+    data = {
+        "model": local_model.model,
+        "prompt": user_message
+    }
+
+    try:
+        async with local_client.stream('POST', url, json=data) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    data = json.loads(line)
+                    if data.get("response"):
+                        yield data["response"]
+                    if data.get("done"):
+                        break
+
+    except httpx.HTTPError as e:
+        log_event(log, 'local model request failed', logging.ERROR, error=str(e))
+        raise
+
+async def stream_response_gemini(model_response):
+    """ Yield text chunks from a generate_content_async(..., stream=True) response """
+    async for chunk in model_response:
+        if chunk.candidates and chunk.candidates[0].content.parts:
+            yield chunk.candidates[0].content.parts[0].text
+
+def sse_response(events):
+    return Response(
+        events,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def process_files(attachments):
+    """ Wait for the background uploads, or upload in worker threads, all at once """
+    return await asyncio.to_thread(server.resolve_attachments, attachments)
+
+
+
+
+
+@app.route('/')
+async def home():
+    chat_history, next_cursor = await get_chats()
+    return await render_template('mybot.html', chat_history=chat_history, next_cursor=next_cursor)
+
+
+@app.route('/list_chats', methods=['GET'])
+async def list_chats():
+    cursor = request.args.get('cursor')
+    if not server.valid_chat_cursor(cursor):
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    chat_history, next_cursor = await get_chats(cursor=cursor)
+    chats = [{
+        'conv_id': chat.get('conv_id'),
+        'message': chat.get('message'),
+        'attached_file_display': chat.get('attached_file_display'),
+        'attachments': server.attachment_display_names(chat),
+    } for chat in chat_history]
+    return jsonify({"chats": chats, "next_cursor": next_cursor})
+
+
+@app.route('/get_chat_content/<conv_id>', methods=['GET'])
+async def get_chat(conv_id):
+    chat_record = await get_chat_by_conv_id(conv_id)
+
+    if chat_record:
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor')
+        if not valid_turn_cursor(chat_record, cursor):
+            return jsonify({"error": "Invalid cursor"}), 400
+        chat_record['content'], chat_record['next_cursor'] = await load_turns(chat_record, limit, cursor)
+        chat_record.pop('conversation_context', None)
+        return jsonify(chat_record)
+    return jsonify({"error": "Chat not found"}), 404
+
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    request_json = await request.get_json()
+    user_message = request_json.get('message')
+    conversation_id = request_json.get('conversation_id')
+    use_local_model = request_json.get('use_local_model')
+    stream = request_json.get('stream', False)
+    requested_attachments = server.request_attachments(request_json)
+    is_new_conversation = False
+    attachments = []
+
+    if use_local_model == 'local':
+        file_paths = [attachment['path'] for attachment in requested_attachments]
+        if stream:
+            async def generate_local():
+                try:
+                    async for text in stream_response_local(user_message, file_paths):
+                        yield server.sse_event({"token": text})
+                except Exception as e:
+                    yield server.sse_error(e)
+                    return
+                yield server.sse_event({"done": True})
+            return sse_response(generate_local())
+
+        response = ''.join([text async for text in stream_response_local(user_message, file_paths)])
+        return jsonify({"response": response})
+
+    if user_message is None:
+        return jsonify({"response": "No message received"}), 400
+
+    if conversation_id is None or conversation_id == '':
+        conversation_id = str(uuid4())
+        context_store.create(conversation_id)
+        is_new_conversation = True
+    else:
+        chat_conv = await get_chat_by_conv_id(conversation_id)
+        if chat_conv is None:
+            return jsonify({"response": "Conversation not found"}), 404
+        attachments = server.conversation_attachments(chat_conv)
+        await load_conversation_context(conversation_id, chat_conv)
+
+    conversation_history = context_store.window(conversation_id, user_message)
+    attachments = server.merge_attachments(attachments, requested_attachments)
+
+    if attachments:
+        files_processed = await process_files(attachments)
+        contents = files_processed + conversation_history
+        request_options = {"timeout": 600}
+    else:
+        contents = conversation_history
+        request_options = {}
+
+    if is_new_conversation:
+        await add_record_chat(conversation_id, user_message, attachments)
+    attachment_status = server.attachment_statuses(attachments)
+
+    if stream:
+        model_response = await model.generate_content_async(
+            contents,
+            stream=True,
+            request_options=request_options
+        )
+
+        async def generate():
+            response = ''
+            try:
+                async for text in stream_response_gemini(model_response):
+                    response += text
+                    yield server.sse_event({"token": text})
+            except Exception as e:
+                yield server.sse_error(e, conversation_id=conversation_id)
+                return
+            await save_chat_turn(conversation_id, user_message, response, attachments)
+            yield server.sse_event({"done": True, "conversation_id": conversation_id, "attachments": attachment_status})
+        return sse_response(generate())
+
+    model_response = await model.generate_content_async(
+        contents,
+        request_options=request_options
+    )
+
+    response = model_response.candidates[0].content.parts[0].text
+    await save_chat_turn(conversation_id, user_message, response, attachments)
+
+    return jsonify({"response": response, "conversation_id": conversation_id, "attachments": attachment_status})
+
+
+@app.route('/upload', methods=['POST'])
+async def upload():
+    files = await request.files
+    if 'file' not in files:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    file = files['file']
+    file_path = os.path.join('uploads', file.filename)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    await file.save(file_path)
+
+    job_id = server.start_ingest(file.filename, file_path)
+
+    return jsonify({"file_path": file_path, "file_name": file.filename, "job_id": job_id})
+
+
+@app.route('/upload_status/<job_id>', methods=['GET'])
+async def upload_status(job_id):
+    job = server.ingest_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    status = {key: value for key, value in dict(job).items() if key != 'future'}
+    start_date = job.get('started_date') or job['created_date']
+    end_date = job.get('finished_date') or datetime.now(timezone.utc)
+    status['elapsed_seconds'] = (end_date - start_date).total_seconds()
+    return jsonify(status)
+
+
+@app.route('/delete_chat/<conv_id>', methods=['POST'])
+async def delete_chat_by_conv_id(conv_id):
+    chat = await db.collection('chat_history').where('conv_id', '==', conv_id).limit(1).get()
+
+    if chat:
+        await db.collection('chat_history').document(chat[0].id).update({'is_deleted': True})
+        context_store.discard(conv_id)
+        server.invalidate_chat_list()
+        return {"message": "Chat deleted successfully"}, 200
+    else:
+        return {"message": "Chat not found"}, 404
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return Response(telemetry.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.after_serving
+async def close_clients():
+    await local_client.aclose()
+
+
+
+
+# Serve with an ASGI server, e.g.  hypercorn server_async:app
+if __name__ == '__main__':
+    log_event(log, 'server running', url="http://127.0.0.1:5000/")
+    app.run(debug=True, use_reloader=False)
@@ -0,0 +1,222 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Prometheus' default buckets, stretched to cover uploads and long generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.1))
+# Traces of requests slower than this are always logged, whatever the sampling
+TRACE_SLOW_SECONDS = float(os.getenv('TRACE_SLOW_SECONDS', 10))
+
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per line: time, level, logger, event and the event's fields """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        trace = _trace.get()
+        if trace is not None:
+            entry['trace_id'] = trace['trace_id']
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level or os.getenv('LOG_LEVEL', 'INFO'))
+
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """ Log event with fields as separate JSON keys """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: ([*counts], total, count) for key, (counts, total, count) in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = list(zip(self.label_names, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(labels + [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """ Values read from collect() when /metrics is scraped; collect returns {label values: value} """
+
+    def __init__(self, name, help_text, label_names, collect, metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.collect = collect
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        try:
+            values = self.collect()
+        except Exception as e:
+            log_event(logger, 'metric collection failed', logging.WARNING, metric=self.name, error=str(e))
+            return lines
+        for key, value in sorted(values.items()):
+            if value is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(list(zip(self.label_names, key)))} {_number(value)}")
+        return lines
+
+
+logger = logging.getLogger(__name__)
+# The trace of the current request; work handed to other threads with
+# contextvars.copy_context().run records its spans into it too
+_trace = contextvars.ContextVar('trace', default=None)
+_metrics = []
+_metrics_lock = threading.Lock()
+
+
+def register(metric):
+    with _metrics_lock:
+        _metrics.append(metric)
+    return metric
+
+
+def render_metrics():
+    """ Every registered metric in the Prometheus text exposition format """
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+stage_seconds = register(Histogram(
+    'chatbot_stage_duration_seconds',
+    'Time spent in each stage of a request',
+    ('stage', 'backend')
+))
+request_seconds = register(Histogram(
+    'chatbot_http_request_duration_seconds',
+    'Time to handle an HTTP request, streamed bodies included',
+    ('method', 'route', 'status')
+))
+
+
+def start_trace(name, **fields):
+    _trace.set({
+        'trace_id': uuid.uuid4().hex[:16],
+        'name': name,
+        'fields': fields,
+        'start': time.perf_counter(),
+        'spans': [],
+        'sampled': random.random() < TRACE_SAMPLE_RATE,
+    })
+
+
+def end_trace(**fields):
+    """ Finish the current trace; sampled or slow traces are logged with their spans """
+    trace = _trace.get()
+    if trace is None:
+        return None
+    _trace.set(None)
+    duration = time.perf_counter() - trace['start']
+    if trace['sampled'] or duration >= TRACE_SLOW_SECONDS:
+        log_event(
+            logger, 'trace', trace_id=trace['trace_id'], name=trace['name'], duration=round(duration, 4),
+            spans=trace['spans'], **dict(trace['fields'], **fields)
+        )
+    return duration
+
+
+@contextmanager
+def span(stage, **labels):
+    """ Time a stage into the stage histogram and the current trace, if any """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        stage_seconds.observe(duration, stage=stage, **labels)
+        trace = _trace.get()
+        if trace is not None:
+            entry = {'stage': stage, 'offset': round(start - trace['start'], 4), 'duration': round(duration, 4)}
+            entry.update(labels)
+            if error:
+                entry['error'] = error
+            trace['spans'].append(entry)
+
+
+def traced(stage, **labels):
+    """ Decorator form of span() """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value))